@@ -0,0 +1,542 @@
+import os
+import json
+import hashlib
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, List, Tuple
+
+from caching import LRUCache, SQLiteCache, TieredCache
+from call_policy import LatencyHistogram
+from config import get_config_section, load_config
+from query_parser import QuerySyntaxError, parse_query
+
+AALWINES_POOL_DEFAULTS = {
+    "workers": None,
+    "query_dir": None
+}
+
+AALWINES_CACHE_DEFAULTS = {
+    "enabled": True,
+    "memory_maxsize": 2048,
+    "path": "results/aalwines_cache.sqlite",
+    "max_bytes": 200_000_000
+}
+
+AALWINES_RUN_DEFAULTS = {
+    "timeout_seconds": 120,
+    "cpu_seconds": 120,
+    "memory_mb": 4096,
+    "use_wsl": None
+}
+
+# Flags of every AalWiNes run; part of the result cache key.
+AALWINES_FLAGS = "--trace 1 -e 1"
+
+# How often a running process is checked for its deadline and cancellation.
+POLL_SECONDS = 0.05
+
+_OOM_MARKERS = ("bad_alloc", "out of memory", "memoryerror", "cannot allocate memory")
+
+
+def windows_to_wsl_path(path: str) -> str:
+    drive, rest = os.path.splitdrive(os.path.abspath(path))
+    drive_letter = drive.rstrip(':').lower()
+    return f"/mnt/{drive_letter}{rest.replace('\\', '/')}"
+
+def get_aalwines_bin():
+    if os.path.exists("config.json"):
+        return load_config().get("aalwines_bin_path")
+
+    raise FileNotFoundError("AalWiNes binary not found. Please set AALWINES_BIN or config.json.")
+
+
+class AalwinesResult:
+    """
+    Outcome of one AalWiNes run. status is "ok", "timeout" (wall-clock or
+    CPU deadline), "oom" (address-space limit or out of memory), "killed"
+    (SIGKILL from outside, e.g. the hard CPU limit or the kernel's OOM
+    killer), "error" (non-zero exit) or "cancelled". Unpacks as (success, output), the
+    output being stderr for failed runs, like the tuples of earlier
+    versions.
+    """
+
+    def __init__(self, status: str, output: str = "", error: str = "", returncode: int | None = None, seconds: float = 0.0):
+        self.status = status
+        self.output = output
+        self.error = error
+        self.returncode = returncode
+        self.seconds = seconds
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+    def __iter__(self):
+        return iter((self.ok, self.output if self.ok else self.error))
+
+    def __repr__(self):
+        return f"AalwinesResult({self.status!r}, returncode={self.returncode}, seconds={self.seconds:.2f})"
+
+
+def _use_wsl() -> bool:
+    setting = get_config_section("aalwines_run", AALWINES_RUN_DEFAULTS)["use_wsl"]
+    return os.name == "nt" if setting is None else bool(setting)
+
+def aalwines_command(network_path: str, weight_path: str, query_path: str) -> List[str]:
+    """
+    argv of a run: the binary itself on Linux and macOS, or the binary
+    inside WSL with translated paths on Windows (aalwines_run.use_wsl).
+    """
+    command = [get_aalwines_bin()]
+    if _use_wsl():
+        command.insert(0, "wsl")
+        network_path, weight_path, query_path = (windows_to_wsl_path(path) for path in (network_path, weight_path, query_path))
+    return command + ["--input", network_path, "-w", weight_path, "-q", query_path, *AALWINES_FLAGS.split()]
+
+def _limits_preexec(settings: Dict[str, Any]):
+    """
+    A preexec_fn that puts the child under the address-space and CPU time
+    limits before AalWiNes is executed, so no part of the run goes
+    unlimited. None without limits or without setrlimit (Windows); runs
+    are then bounded by the wall-clock deadline alone.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    limits = []
+    if settings["memory_mb"]:
+        memory = int(settings["memory_mb"]) * 1024 * 1024
+        limits.append((resource.RLIMIT_AS, memory, memory))
+    if settings["cpu_seconds"]:
+        cpu = int(settings["cpu_seconds"])
+        # SIGXCPU at the soft limit, SIGKILL one second later.
+        limits.append((resource.RLIMIT_CPU, cpu, cpu + 1))
+    # An unprivileged process cannot raise its hard limits.
+    clamped = []
+    for which, soft, hard in limits:
+        current = resource.getrlimit(which)[1]
+        if current != resource.RLIM_INFINITY:
+            soft, hard = min(soft, current), min(hard, current)
+        clamped.append((which, (soft, hard)))
+    if not clamped:
+        return None
+
+    def apply_limits():
+        for which, limit in clamped:
+            resource.setrlimit(which, limit)
+
+    return apply_limits
+
+def _kill(process: subprocess.Popen):
+    """
+    Kills the run's whole process group, so helpers it started die too.
+    """
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def _classify(returncode: int, stderr: str) -> str:
+    if returncode == 0:
+        return "ok"
+    if any(marker in stderr.lower() for marker in _OOM_MARKERS):
+        return "oom"
+    if os.name == "posix" and returncode == -signal.SIGXCPU:
+        return "timeout"
+    if os.name == "posix" and returncode == -signal.SIGKILL:
+        # Not our kill: the hard CPU limit (if SIGXCPU was ignored), the
+        # kernel's OOM killer or someone else; the exit status cannot tell.
+        return "killed"
+    return "error"
+
+def execute_aalwines(query: str, network_path: str, weight_path: str, query_path: str,
+                     cancel: threading.Event | None = None) -> AalwinesResult:
+    """
+    Runs AalWiNes on a query (several lines for several queries) without a
+    shell, in its own process group, under the limits of the
+    "aalwines_run" section of config.json: a wall-clock deadline, a CPU
+    time limit and an address-space limit. Setting `cancel` kills the run.
+    """
+    settings = get_config_section("aalwines_run", AALWINES_RUN_DEFAULTS)
+    with open(query_path, 'w', encoding='utf-8') as f:
+        f.write(query)
+
+    start = time.monotonic()
+    process = subprocess.Popen(
+        aalwines_command(network_path, weight_path, query_path),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        start_new_session=os.name == "posix",
+        preexec_fn=_limits_preexec(settings),
+        creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == "nt" else 0
+    )
+
+    killed = None
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=POLL_SECONDS)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel is not None and cancel.is_set():
+                killed = "cancelled"
+            elif settings["timeout_seconds"] and time.monotonic() - start > settings["timeout_seconds"]:
+                killed = "timeout"
+            else:
+                continue
+            _kill(process)
+            stdout, stderr = process.communicate()
+            break
+
+    seconds = time.monotonic() - start
+    status = killed or _classify(process.returncode, stderr)
+    if status == "timeout":
+        stderr = f"AalWiNes did not finish within its limits ({seconds:.1f}s).\n{stderr}"
+    elif status == "oom":
+        stderr = f"AalWiNes ran out of memory (limit {settings['memory_mb']} MB).\n{stderr}"
+    elif status == "killed":
+        stderr = f"AalWiNes was killed after {seconds:.1f}s (CPU limit or the system's OOM killer).\n{stderr}"
+    elif status == "cancelled":
+        stderr = f"AalWiNes run cancelled after {seconds:.1f}s.\n{stderr}"
+    if status != "ok":
+        print(f"AalWiNes {status}:\n{stderr}")
+    return AalwinesResult(status, stdout, stderr, process.returncode, seconds)
+
+
+def run_aalwines(query: str, network_path: str, weight_path: str, query_path: str):
+    """
+    Runs one query file and returns (success, output); see execute_aalwines.
+    """
+    return tuple(execute_aalwines(query, network_path, weight_path, query_path))
+
+
+_file_hashes: Dict[str, Tuple[Tuple[int, int, int], str]] = {}
+_file_hashes_lock = threading.Lock()
+
+def file_hash(path: str) -> str:
+    """
+    sha256 of a file's contents, recomputed only when its size, mtime or
+    inode change.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+    with _file_hashes_lock:
+        known = _file_hashes.get(path)
+        if known is not None and known[0] == stamp:
+            return known[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    with _file_hashes_lock:
+        _file_hashes[path] = (stamp, digest)
+    return digest
+
+_normalized_queries = LRUCache(maxsize=4096)
+
+def normalize_query(query: str) -> str:
+    """
+    Canonical text of a query (parsed and formatted again), or the query
+    with collapsed whitespace if it does not parse. Memoized, since the
+    same queries are looked up over and over.
+    """
+    query = " ".join(query.split())
+    normalized = _normalized_queries.get(query)
+    if normalized is None:
+        try:
+            normalized = parse_query(query).format()
+        except QuerySyntaxError:
+            normalized = query
+        _normalized_queries.put(query, normalized)
+    return normalized
+
+def result_cache_key(query: str, network_path: str, weight_path: str) -> str:
+    """
+    Content address of a run: hashes of the network and weight files, the
+    normalized query, the binary and the flags. Editing the network file
+    changes the key, so stale results are never served.
+    """
+    parts = [file_hash(network_path), file_hash(weight_path), normalize_query(query), str(get_aalwines_bin()), AALWINES_FLAGS]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache() -> TieredCache | None:
+    """
+    Returns the process-wide AalWiNes result cache (memory LRU in front of
+    a size-bounded SQLite file), or None if disabled in the
+    "aalwines_cache" section of config.json.
+    """
+    global _result_cache
+    settings = get_config_section("aalwines_cache", AALWINES_CACHE_DEFAULTS)
+    if not settings["enabled"]:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            disk = SQLiteCache(settings["path"], settings["max_bytes"]) if settings["path"] else None
+            _result_cache = TieredCache(LRUCache(settings["memory_maxsize"]), disk)
+        return _result_cache
+
+def result_cache_stats() -> Dict[str, Any]:
+    cache = get_result_cache()
+    return cache.stats() if cache is not None else {}
+
+def _cache_keys(queries: List[str], network_path: str, weight_path: str) -> List[str | None]:
+    if get_result_cache() is None:
+        return [None] * len(queries)
+    try:
+        return [result_cache_key(query, network_path, weight_path) for query in queries]
+    except OSError:
+        return [None] * len(queries)
+
+def _from_cache(cache, key: str | None) -> AalwinesResult | None:
+    # Only successful runs are cached, as (True, output).
+    cached = cache.get(key) if key else None
+    return AalwinesResult("ok", cached[1]) if cached is not None else None
+
+def cached_results(queries: List[str], network_path: str, weight_path: str) -> List[AalwinesResult | None]:
+    """
+    The cached result of each query, None where there is none.
+    """
+    cache = get_result_cache()
+    return [_from_cache(cache, key) for key in _cache_keys(queries, network_path, weight_path)]
+
+def split_answers(output: str, count: int) -> List[str]:
+    """
+    Splits the output of a run over `count` queries into one output per
+    query, each shaped like the output of a single-query run (its answer
+    under "Q1"). Raises ValueError if an answer is missing.
+    """
+    result = json.loads(output)
+    answers = result.get("answers", {})
+    outputs = []
+    for number in range(1, count + 1):
+        if f"Q{number}" not in answers:
+            raise ValueError(f"AalWiNes output has no answer Q{number}")
+        outputs.append(json.dumps({**result, "answers": {"Q1": answers[f"Q{number}"]}}))
+    return outputs
+
+
+def run_aalwines_batch(queries: List[str], network_path: str, weight_path: str, query_path: str,
+                       cancel: threading.Event | None = None) -> List[AalwinesResult]:
+    """
+    Runs several queries on the same network with one AalWiNes invocation
+    (one query per line of the query file, answered as Q1, Q2, ...), so the
+    network is parsed once. Returns one AalwinesResult per query, in input
+    order. If the combined run fails, e.g. because one query does not
+    parse or runs out of time, each query is run on its own so the others
+    still get a result. Queries with a cached result are not run;
+    successful runs are cached.
+    """
+    queries = [" ".join(query.split()) for query in queries]
+    keys = _cache_keys(queries, network_path, weight_path)
+    cache = get_result_cache()
+    results = [_from_cache(cache, key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    for i, result in zip(missing, _run_uncached([queries[i] for i in missing], network_path, weight_path, query_path, cancel)):
+        results[i] = result
+        if result.ok and keys[i]:
+            cache.put(keys[i], (True, result.output))
+    return results
+
+def _run_uncached(queries: List[str], network_path: str, weight_path: str, query_path: str,
+                  cancel: threading.Event | None) -> List[AalwinesResult]:
+    if len(queries) <= 1:
+        return [execute_aalwines(query, network_path, weight_path, query_path, cancel) for query in queries]
+    combined = execute_aalwines("\n".join(queries) + "\n", network_path, weight_path, query_path, cancel)
+    if combined.status == "cancelled":
+        return [combined] * len(queries)
+    if combined.ok:
+        try:
+            return [AalwinesResult("ok", answer, seconds=combined.seconds) for answer in split_answers(combined.output, len(queries))]
+        except ValueError as e:
+            print(f"[!] Could not split batched AalWiNes output: {e}")
+    print(f"[!] Batched AalWiNes run of {len(queries)} queries failed ({combined.status}), running them one by one.")
+    results = []
+    for query in queries:
+        if cancel is not None and cancel.is_set():
+            results.append(AalwinesResult("cancelled", error="AalWiNes run cancelled."))
+        else:
+            results.append(execute_aalwines(query, network_path, weight_path, query_path, cancel))
+    return results
+
+
+class AalwinesJob:
+    """
+    One queued AalWiNes run of a query, or of a list of queries batched
+    into one invocation. The pool fills in the timestamps; run_seconds and
+    wait_seconds are None until the job has started or finished. Setting
+    `cancel` kills the running process.
+    """
+
+    def __init__(self, query: str | List[str], network_path: str, weight_path: str):
+        self.query = query
+        self.network_path = network_path
+        self.weight_path = weight_path
+        self.submitted = time.perf_counter()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.cancel = threading.Event()
+
+    @property
+    def wait_seconds(self) -> float | None:
+        return self.started - self.submitted if self.started is not None else None
+
+    @property
+    def run_seconds(self) -> float | None:
+        return self.finished - self.started if self.finished is not None else None
+
+
+class AalwinesPool:
+    """
+    Runs AalWiNes in up to `workers` concurrent processes. Every job writes
+    its query to its own temporary file in query_dir (default: the system
+    temp directory), so concurrent runs never see each other's queries.
+    submit() returns a Future of an AalwinesResult (which unpacks as
+    (success, output)) with the job attached as `future.job`,
+    submit_batch() a Future of one result per query run in a single
+    invocation; cancel() drops a queued job or kills a running one. Jobs
+    whose results are all in the result cache are not queued: their
+    Future is already done.
+    """
+
+    def __init__(self, workers: int | None = None, query_dir: str | None = None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.query_dir = query_dir
+        if query_dir:
+            os.makedirs(query_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="aalwines")
+        self._lock = threading.Lock()
+        self._counts = {"submitted": 0, "running": 0, "completed": 0, "failed": 0, "cancelled": 0, "cache_hits": 0, "queries": 0}
+        self._statuses = {status: 0 for status in ("ok", "timeout", "oom", "killed", "error", "cancelled")}
+        self.run_times = LatencyHistogram()
+        self.wait_times = LatencyHistogram()
+
+    def _count(self, name: str, delta: int = 1):
+        with self._lock:
+            self._counts[name] += delta
+
+    def _run(self, job: AalwinesJob):
+        job.started = time.perf_counter()
+        self.wait_times.record(job.wait_seconds)
+        self._count("running")
+        fd, query_path = tempfile.mkstemp(suffix=".q", prefix="aalwines-", dir=self.query_dir)
+        os.close(fd)
+        success = False
+        try:
+            queries = job.query if isinstance(job.query, list) else [job.query]
+            results = run_aalwines_batch(queries, job.network_path, job.weight_path, query_path, job.cancel)
+            self._count("queries", len(queries))
+            with self._lock:
+                for result in results:
+                    self._statuses[result.status] += 1
+            success = all(result.ok for result in results)
+            return results if isinstance(job.query, list) else results[0]
+        finally:
+            job.finished = time.perf_counter()
+            self.run_times.record(job.run_seconds)
+            self._count("running", -1)
+            self._count("completed" if success else "failed")
+            try:
+                os.remove(query_path)
+            except OSError:
+                pass
+
+    def _submit(self, job: AalwinesJob) -> Future:
+        self._count("submitted")
+        queries = job.query if isinstance(job.query, list) else [job.query]
+        cached = cached_results(queries, job.network_path, job.weight_path)
+        if all(result is not None for result in cached):
+            job.started = job.finished = time.perf_counter()
+            self._count("cache_hits")
+            future = Future()
+            future.set_result(cached if isinstance(job.query, list) else cached[0])
+        else:
+            future = self._executor.submit(self._run, job)
+        future.job = job
+        return future
+
+    def submit(self, query: str, network_path: str, weight_path: str) -> Future:
+        return self._submit(AalwinesJob(query, network_path, weight_path))
+
+    def submit_batch(self, queries: List[str], network_path: str, weight_path: str) -> Future:
+        """
+        Runs the queries (all on the same network) in one AalWiNes
+        invocation; the Future's result is one AalwinesResult per query.
+        """
+        return self._submit(AalwinesJob(list(queries), network_path, weight_path))
+
+    def cancel(self, future: Future) -> bool:
+        """
+        Cancels a job: a queued job is dropped, a running one is killed
+        with its process group and ends with status "cancelled". Returns
+        False if the job has already finished.
+        """
+        if future.cancel():
+            self._count("cancelled")
+            return True
+        if future.done():
+            return False
+        future.job.cancel.set()
+        return True
+
+    def wait(self, futures: Iterable[Future], timeout: float | None = None, return_when=FIRST_COMPLETED):
+        """
+        concurrent.futures.wait over jobs of this pool: (done, not_done).
+        """
+        return wait(list(futures), timeout=timeout, return_when=return_when)
+
+    def run(self, query: str, network_path: str, weight_path: str) -> AalwinesResult:
+        """
+        Submits one job and blocks until its result.
+        """
+        return self.submit(query, network_path, weight_path).result()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Job counters, queries run (a batch counts each of its queries) and
+        their result statuses, current queue depth (submitted jobs not yet
+        started, cancelled or answered from the cache) and run/queue-wait
+        time percentiles.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            statuses = dict(self._statuses)
+        finished = counts["completed"] + counts["failed"] + counts["cancelled"] + counts["cache_hits"]
+        return {
+            "workers": self.workers,
+            **counts,
+            "queue_depth": counts["submitted"] - finished - counts["running"],
+            "statuses": statuses,
+            "run_time": self.run_times.snapshot(),
+            "wait_time": self.wait_times.snapshot(),
+        }
+
+    def shutdown(self, wait: bool = True, cancel_pending: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_pending)
+
+
+_pool: AalwinesPool | None = None
+_pool_lock = threading.Lock()
+
+def get_aalwines_pool() -> AalwinesPool:
+    """
+    Returns the process-wide pool configured by the "aalwines_pool" section
+    of config.json (workers: None means one per CPU core). All Streamlit
+    sessions share it.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            settings = get_config_section("aalwines_pool", AALWINES_POOL_DEFAULTS)
+            _pool = AalwinesPool(settings["workers"], settings["query_dir"])
+        return _pool
+
+def aalwines_pool_metrics() -> Dict[str, Any]:
+    return get_aalwines_pool().metrics()
@@ -1,7 +1,8 @@
 import streamlit as st
 import os
+import sys
 from datetime import datetime
-from prompt_builder import regenerate_full_query_until_valid, generate_answer
+from prompt_builder import regenerate_full_query_until_valid, generate_answer_stream
 from network_parser import load_network_model
 import json
 from student_query_checker import verify_trace, is_structurally_valid, are_queries_equivalent
@@ -12,11 +13,12 @@ import uuid
 
 # --- Configuration ---
 WEIGHT_PATH = "run/Agis-weight.json"
-QUERY_PATH = "run/Agis-query.q"
 NETWORK_DIR = "networks"
 LOG_FILE = "results/usage_log.csv"
 TEST_FILE = "run/tasks.json"
 
+sys.stdout.reconfigure(encoding='utf-8')
+
 
 def log_event(
     event_type,
@@ -65,8 +67,13 @@ def restart_quiz():
     st.session_state.stage = 2  # Go to quiz stage (trial task)
     st.rerun()
 
-with open(TEST_FILE, "r", encoding="utf-8") as f:
-    test_tasks = json.load(f)
+@st.cache_data
+def load_test_tasks(path: str, mtime: float):
+    # Parsed once per file version instead of on every rerun.
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+test_tasks = load_test_tasks(TEST_FILE, os.path.getmtime(TEST_FILE))
 # --- UI ---
 st.set_page_config(page_title="AalWiNes Query Generator", layout="wide")
 st.title("AalWiNes Query Generator Study")
@@ -302,21 +309,32 @@ if st.session_state.stage == 2:
 
         if st.button("Ask", key="ask_button"):
             if user_input.strip():
-                with st.spinner("Thinking..."):
-                    try:
-                        response = generate_answer(user_input)
-                        st.session_state.chat_history.append(("You", user_input))
-                        st.session_state.chat_history.append(("AI", response))
-                        log_event(
-                            event_type="llm_chat",
-                            stage="quiz",
-                            data={
-                                "question": user_input,
-                                "response": response
-                            }
-                        )
-                    except Exception as e:
-                        st.error(f"Error getting answer: {e}")
+                # Render the answer while it streams in; it moves into the
+                # history below once complete.
+                live_answer = st.empty()
+                try:
+                    stream = generate_answer_stream(user_input)
+                    with live_answer.container():
+                        st.markdown(f"**🧑 You:** {user_input}")
+                        st.write_stream(stream)
+                    response = stream.text
+                    live_answer.empty()
+                    st.session_state.chat_history.append(("You", user_input))
+                    st.session_state.chat_history.append(("AI", response))
+                    log_event(
+                        event_type="llm_chat",
+                        stage="quiz",
+                        data={
+                            "question": user_input,
+                            "response": response,
+                            "time_to_first_token_ms": round(stream.time_to_first_token * 1000) if stream.time_to_first_token is not None else None,
+                            "cached": stream.cached,
+                            "tokens": stream.usage
+                        }
+                    )
+                except Exception as e:
+                    live_answer.empty()
+                    st.error(f"Error getting answer: {e}")
             else:
                 st.warning("Please enter a question.")
         
@@ -455,8 +473,7 @@ if st.session_state.stage == 2:
                         user_input + " DUAL",
                         task["solution"] + " DUAL",
                         task_model,
-                        WEIGHT_PATH,
-                        QUERY_PATH
+                        WEIGHT_PATH
                     )
 
                 structure_ok = is_structurally_valid(user_input, task)
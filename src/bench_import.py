@@ -0,0 +1,123 @@
+"""
+Measures cold import time of the pipeline modules and Streamlit rerun time.
+
+    python src/bench_import.py
+    python src/bench_import.py --repeat 5 --app
+
+Each module is imported in a fresh interpreter with `python -X importtime`;
+the best cumulative time over --repeat runs is compared to its budget.
+Heavy dependencies (faiss, numpy, openai, ...) must not be loaded by the
+import itself, only by the code paths that use them. With --app the
+Streamlit app is also run headless (streamlit.testing AppTest): the first
+run and the mean of the following reruns are compared to their budgets.
+Exits with status 1 if a budget is exceeded.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cold import budgets in milliseconds.
+IMPORT_BUDGETS_MS = {
+    "prompt_builder": 400,
+    "rag_network": 300,
+    "student_query_checker": 450,
+    "main": 450,
+}
+
+LAZY_MODULES = ("faiss", "numpy", "openai", "tqdm", "pyformlang", "dotenv")
+
+APP_BUDGETS_MS = {
+    "first_run": 3000,
+    "rerun": 500,
+}
+
+
+def import_time_ms(module: str) -> float:
+    """
+    Cumulative import time of `module` in a fresh interpreter.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True
+    )
+    for line in reversed(result.stderr.splitlines()):
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000
+    raise RuntimeError(f"No import time reported for {module}:\n{result.stderr}")
+
+
+def eagerly_loaded(module: str):
+    """
+    The LAZY_MODULES that importing `module` loads anyway.
+    """
+    check = f"import sys, {module}; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", check], cwd=SRC_DIR, capture_output=True, text=True, check=True)
+    return [name for name in result.stdout.strip().split(",") if name]
+
+
+def app_run_times_ms(reruns: int):
+    """
+    Wall time of the first headless run of app.py and the mean of `reruns`
+    further runs of the same session.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    os.chdir(os.path.dirname(SRC_DIR))
+    app = AppTest.from_file(os.path.join(SRC_DIR, "app.py"), default_timeout=60)
+    start = time.perf_counter()
+    app.run()
+    first = (time.perf_counter() - start) * 1000
+    times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        app.run()
+        times.append((time.perf_counter() - start) * 1000)
+    if app.exception:
+        raise RuntimeError(f"app.py raised: {app.exception[0].message}")
+    return first, sum(times) / len(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and Streamlit rerun budgets.")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per module, best time counts")
+    parser.add_argument("--modules", default=",".join(IMPORT_BUDGETS_MS), help="comma-separated modules")
+    parser.add_argument("--app", action="store_true", help="also time headless runs of the Streamlit app")
+    parser.add_argument("--reruns", type=int, default=5)
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':<24} {'import ms':>10} {'budget ms':>10}  eager heavy imports")
+    for module in args.modules.split(","):
+        best = min(import_time_ms(module) for _ in range(args.repeat))
+        budget = IMPORT_BUDGETS_MS.get(module)
+        eager = eagerly_loaded(module)
+        print(f"{module:<24} {best:>10.1f} {budget if budget is not None else '-':>10}  {', '.join(eager) or '-'}")
+        if budget is not None and best > budget:
+            failures.append(f"import {module} took {best:.0f} ms (budget {budget} ms)")
+        if eager:
+            failures.append(f"import {module} loads {', '.join(eager)} eagerly")
+
+    if args.app:
+        first, rerun = app_run_times_ms(args.reruns)
+        print(f"\n{'app.py first run':<24} {first:>10.1f} {APP_BUDGETS_MS['first_run']:>10}")
+        print(f"{'app.py rerun (mean)':<24} {rerun:>10.1f} {APP_BUDGETS_MS['rerun']:>10}")
+        if first > APP_BUDGETS_MS["first_run"]:
+            failures.append(f"first app run took {first:.0f} ms (budget {APP_BUDGETS_MS['first_run']} ms)")
+        if rerun > APP_BUDGETS_MS["rerun"]:
+            failures.append(f"app rerun took {rerun:.0f} ms (budget {APP_BUDGETS_MS['rerun']} ms)")
+
+    if failures:
+        print("\n[!] Over budget:")
+        for failure in failures:
+            print(f"    {failure}")
+        sys.exit(1)
+    print("\n[✓] All within budget.")
+
+
+if __name__ == "__main__":
+    main()
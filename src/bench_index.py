@@ -0,0 +1,104 @@
+"""
+Compares the example index types on recall and latency.
+
+    python src/bench_index.py --n 20000 --dim 256 --k 5
+    python src/bench_index.py --source embeddings/examples.json
+
+For each type in vector_index.INDEX_TYPES it reports recall@k against the
+exact flat index, p50/p99 single-query search latency, build time and
+serialized bytes per vector. Build parameters come from the
+"example_index" section of config.json.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from config import get_config_section
+from embedding_store import open_embedding_store
+from vector_index import INDEX_DEFAULTS, INDEX_TYPES, build_vector_index, bytes_per_vector, index_factory_string
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """
+    Gaussian clusters on the unit sphere, roughly shaped like text embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size=n)] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_vectors(args) -> np.ndarray:
+    if args.source == "synthetic":
+        return synthetic_vectors(args.n, args.dim)
+    store = open_embedding_store(args.source)
+    if len(store) == 0:
+        raise SystemExit(f"No embeddings found in {args.source}")
+    return np.asarray(store.matrix(), dtype=np.float32)
+
+
+def benchmark(vectors: np.ndarray, queries: np.ndarray, k: int, settings: dict, types=INDEX_TYPES):
+    exact = build_vector_index(vectors, {"type": "flat"})
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    rows = []
+    for index_type in types:
+        type_settings = {**settings, "type": index_type}
+        start = time.perf_counter()
+        index = build_vector_index(vectors, type_settings)
+        index.add(vectors)
+        build_s = time.perf_counter() - start
+
+        _, found = index.search(queries, k)
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query[None, :], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        rows.append({
+            "type": index_type,
+            "factory": index_factory_string(type_settings, len(vectors), vectors.shape[1]),
+            "build_s": build_s,
+            "recall": recall,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "bytes_per_vector": bytes_per_vector(index),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency benchmark of the example index types.")
+    parser.add_argument("--source", default="synthetic", help="'synthetic' or an embedding cache such as embeddings/examples.json")
+    parser.add_argument("--n", type=int, default=20000, help="number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=256, help="dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="comma-separated index types")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    rng = np.random.default_rng(1)
+    picks = rng.integers(0, len(vectors), size=args.queries)
+    # Perturbed corpus vectors, so queries look like the corpus without being in it.
+    queries = vectors[picks] + 0.05 * rng.normal(size=(args.queries, vectors.shape[1])).astype(np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+
+    settings = get_config_section("example_index", INDEX_DEFAULTS)
+    k = min(args.k, len(vectors))
+    rows = benchmark(vectors, queries, k, settings, args.types.split(","))
+
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, {args.queries} queries, k={k}\n")
+    print(f"{'type':<6} {'factory':<14} {'build s':>8} {'recall@' + str(k):>9} {'p50 ms':>8} {'p99 ms':>8} {'bytes/vec':>10}")
+    for row in rows:
+        print(f"{row['type']:<6} {row['factory']:<14} {row['build_s']:>8.2f} {row['recall']:>9.3f} "
+              f"{row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f} {row['bytes_per_vector']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
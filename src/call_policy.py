@@ -0,0 +1,280 @@
+import bisect
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict
+
+from config import get_config_section
+
+CALL_POLICY_DEFAULTS = {
+    "deadline_seconds": 30,
+    "endpoint_deadlines": {},
+    "max_retries": 4,
+    "backoff_base_seconds": 0.5,
+    "backoff_max_seconds": 20,
+    "retry_budget_ratio": 0.2,
+    "retry_budget_min": 10,
+    "hedge": False,
+    "hedge_quantile": 0.95,
+    "hedge_min_samples": 20,
+    "hedge_max_workers": 8
+}
+
+RETRYABLE_STATUS = 429
+
+
+class CallDeadlineExceeded(TimeoutError):
+    pass
+
+
+class LatencyHistogram:
+    """
+    Thread-safe latency histogram with logarithmic buckets from 1 ms to
+    about 5 minutes, each 25% wider than the previous one. Quantiles are
+    reported as the upper bound of their bucket.
+    """
+
+    BOUNDS = [0.001 * 1.25 ** i for i in range(57)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def quantile(self, q: float) -> float | None:
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            seen = 0
+            for i, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= rank and bucket_count:
+                    return self.BOUNDS[min(i, len(self.BOUNDS) - 1)]
+            return self.BOUNDS[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        ms = lambda seconds: round(seconds * 1000, 1) if seconds is not None else None
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.quantile(0.5)),
+            "p95_ms": ms(self.quantile(0.95)),
+            "p99_ms": ms(self.quantile(0.99)),
+        }
+
+
+class RetryBudget:
+    """
+    Process-wide limit on retries and hedged requests: every first attempt
+    earns `ratio` tokens, every retry or hedge spends one, and `minimum`
+    tokens are always available. This keeps a failing backend from being
+    hit with max_retries times the normal load.
+    """
+
+    def __init__(self, ratio: float, minimum: float):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.tokens = minimum
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            # The budget refills up to `minimum` plus what recent traffic earned.
+            self.tokens = min(self.tokens + self.ratio, self.minimum + 100 * self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class CallStats:
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, endpoint: str) -> LatencyHistogram:
+        with self._lock:
+            return self.histograms.setdefault(endpoint, LatencyHistogram())
+
+    def count(self, endpoint: str, name: str):
+        with self._lock:
+            counters = self.counters.setdefault(endpoint, {})
+            counters[name] = counters.get(name, 0) + 1
+
+
+_stats = CallStats()
+_retry_budget: RetryBudget | None = None
+_hedge_pool: ThreadPoolExecutor | None = None
+_lock = threading.Lock()
+
+
+def _settings() -> Dict[str, Any]:
+    return get_config_section("llm_calls", CALL_POLICY_DEFAULTS)
+
+
+def get_retry_budget() -> RetryBudget:
+    global _retry_budget
+    with _lock:
+        if _retry_budget is None:
+            settings = _settings()
+            _retry_budget = RetryBudget(settings["retry_budget_ratio"], settings["retry_budget_min"])
+        return _retry_budget
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    with _lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=_settings()["hedge_max_workers"], thread_name_prefix="hedge")
+        return _hedge_pool
+
+
+def call_stats() -> Dict[str, Any]:
+    """
+    Latency histogram summary and counters (calls, retries, hedges,
+    hedge_wins, errors, deadline_exceeded) per endpoint.
+    """
+    with _stats._lock:
+        endpoints = set(_stats.histograms) | set(_stats.counters)
+    return {
+        endpoint: {**_stats.histogram(endpoint).snapshot(), **_stats.counters.get(endpoint, {})}
+        for endpoint in sorted(endpoints)
+    }
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Rate limits, server errors, timeouts and connection failures are worth
+    retrying; other client errors are not.
+    """
+    import openai
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status == RETRYABLE_STATUS or (status is not None and status >= 500)
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _attempt(endpoint: str, call: Callable[[float], Any], timeout: float, hedge_after: float | None):
+    """
+    One attempt, with a hedged second request if the first has not answered
+    after hedge_after seconds. Returns the first successful result; raises
+    the first error if all requests fail.
+    """
+    if hedge_after is None or hedge_after >= timeout:
+        start = time.perf_counter()
+        result = call(timeout)
+        _stats.histogram(endpoint).record(time.perf_counter() - start)
+        return result
+
+    pool = _get_hedge_pool()
+    start = time.perf_counter()
+    timed = lambda: (call(max(0.001, timeout - (time.perf_counter() - start))), time.perf_counter())
+    pending = {pool.submit(timed)}
+    done, pending = wait(pending, timeout=hedge_after)
+    hedged = None
+    if not done and get_retry_budget().withdraw():
+        _stats.count(endpoint, "hedges")
+        hedged = pool.submit(timed)
+        pending.add(hedged)
+
+    first_error = None
+    while True:
+        for future in done:
+            try:
+                result, finished = future.result()
+            except Exception as e:
+                first_error = first_error or e
+                continue
+            if future is hedged:
+                _stats.count(endpoint, "hedge_wins")
+            _stats.histogram(endpoint).record(finished - start)
+            # The slower request is abandoned; it ends with its own timeout.
+            return result
+        if not pending:
+            raise first_error
+        remaining = timeout - (time.perf_counter() - start)
+        if remaining <= 0:
+            raise CallDeadlineExceeded(f"{endpoint} call did not answer within {timeout:.1f}s")
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+
+def call_with_policy(
+    endpoint: str,
+    call: Callable[[float], Any],
+    deadline: float | None = None,
+    hedge: bool | None = None,
+    max_retries: int | None = None
+):
+    """
+    Runs call(timeout) under the "llm_calls" policy of config.json: the whole
+    call, retries included, ends after `deadline` seconds (per-endpoint
+    default), each request gets the remaining time as its timeout, retryable
+    errors (429, 5xx, timeouts) are retried with jittered exponential
+    backoff or the server's Retry-After while the global retry budget
+    allows, and with hedging a second request is sent once the first is
+    slower than the endpoint's p95 latency. Only use hedging for calls that
+    are safe to send twice.
+    """
+    settings = _settings()
+    if deadline is None:
+        deadline = settings["endpoint_deadlines"].get(endpoint, settings["deadline_seconds"])
+    if hedge is None:
+        hedge = settings["hedge"]
+    if max_retries is None:
+        max_retries = settings["max_retries"]
+
+    budget = get_retry_budget()
+    budget.deposit()
+    _stats.count(endpoint, "calls")
+    end = time.monotonic() + deadline
+    delay = settings["backoff_base_seconds"]
+
+    for attempt in range(max_retries + 1):
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            break
+        hedge_after = None
+        if hedge and _stats.histogram(endpoint).count >= settings["hedge_min_samples"]:
+            hedge_after = _stats.histogram(endpoint).quantile(settings["hedge_quantile"])
+        try:
+            return _attempt(endpoint, call, remaining, hedge_after)
+        except Exception as e:
+            if not is_retryable(e):
+                _stats.count(endpoint, "errors")
+                raise
+            if time.monotonic() >= end:
+                break
+            wait_seconds = retry_after_seconds(e) or delay * (0.5 + random.random())
+            if attempt == max_retries or time.monotonic() + wait_seconds >= end or not budget.withdraw():
+                _stats.count(endpoint, "errors")
+                raise
+            _stats.count(endpoint, "retries")
+            print(f"[!] {endpoint} call failed ({type(e).__name__}), retrying in {wait_seconds:.1f}s")
+            time.sleep(wait_seconds)
+            delay = min(delay * 2, settings["backoff_max_seconds"])
+
+    _stats.count(endpoint, "deadline_exceeded")
+    raise CallDeadlineExceeded(f"{endpoint} call did not finish within its {deadline:.0f}s deadline")
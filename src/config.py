@@ -0,0 +1,36 @@
+import json
+import os
+from typing import Any, Dict
+
+CONFIG_PATH = "config.json"
+
+_config_cache: Dict[str, Any] = {}
+
+
+def load_config(path: str = CONFIG_PATH) -> Dict[str, Any]:
+    """
+    Loads config.json. The parsed file is kept until its modification time
+    changes, so callers may look up settings on every request.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+
+    cached = _config_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    _config_cache[path] = (mtime, config)
+    return config
+
+
+def get_config_section(name: str, defaults: Dict[str, Any] | None = None, path: str = CONFIG_PATH) -> Dict[str, Any]:
+    """
+    Returns one section of config.json merged over the given defaults.
+    """
+    section = dict(defaults or {})
+    section.update(load_config(path).get(name, {}) or {})
+    return section
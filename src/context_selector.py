@@ -0,0 +1,182 @@
+import difflib
+import re
+from collections import deque
+from typing import Dict, List
+
+from config import get_config_section
+
+CONTEXT_DEFAULTS = {
+    "token_budget": 1000,
+    "full_list_max_tokens": 500,
+    "neighbour_hops": 1,
+    "fuzzy_cutoff": 0.8
+}
+
+WORD_PATTERN = re.compile(r"[A-Za-z_][\w\-]*|\d+")
+# Numbers that count something ("2 link failures", "3 hops") name neither
+# a label nor a router.
+QUANTITY_PATTERN = re.compile(
+    r"\b\d+\s+(?:link\s+)?(?:failures?|failed|links?|hops?|routers?|labels?|paths?|times)\b",
+    re.IGNORECASE
+)
+DIGITS_PATTERN = re.compile(r"\d+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count (about four characters per token), good enough for budgeting.
+    """
+    return (len(text) + 3) // 4
+
+
+class NetworkContext:
+    """
+    The routers and labels of a network that go into a prompt, and how much
+    of the full lists was pruned to get there.
+    """
+
+    def __init__(self, routers: List[str], labels: List[str], stats: Dict[str, int]):
+        self.routers = routers
+        self.labels = labels
+        self.stats = stats
+
+    @property
+    def pruned(self) -> bool:
+        return self.stats["routers_included"] < self.stats["routers_total"] or \
+            self.stats["labels_included"] < self.stats["labels_total"]
+
+    def __repr__(self):
+        s = self.stats
+        return (f"NetworkContext(routers={s['routers_included']}/{s['routers_total']}, "
+                f"labels={s['labels_included']}/{s['labels_total']}, "
+                f"tokens~{s['tokens_included']}/{s['tokens_full']})")
+
+
+def _prefix_at_boundary(prefix: str, name: str) -> bool:
+    # "sydney" is a prefix of Sydney1 and Sydney_2 at a token boundary,
+    # "syd" of Sydney1 and "r1" of R10 are not.
+    if not name.startswith(prefix) or len(name) == len(prefix):
+        return False
+    last, following = prefix[-1], name[len(prefix)]
+    return not (last.isalpha() and following.isalpha() or last.isdigit() and following.isdigit())
+
+
+def match_routers(words: List[str], routers: List[str], cutoff: float) -> List[str]:
+    """
+    Routers named in the words: case-insensitive exact matches, names the
+    word is a prefix of at a token boundary ("sydney" -> Sydney1, Sydney2)
+    and close fuzzy matches with the same numbers ("melborne1" ->
+    Melbourne1). Bare numbers only match exactly, so "777" does not name
+    R777.
+    """
+    by_lower = {router.lower(): router for router in routers}
+    matched = []
+    for word in words:
+        lower = word.lower()
+        if lower in by_lower:
+            hits = [by_lower[lower]]
+        elif lower.isdigit():
+            hits = []
+        else:
+            hits = [router for key, router in by_lower.items() if len(lower) >= 3 and _prefix_at_boundary(lower, key)]
+            if not hits:
+                digits = DIGITS_PATTERN.findall(lower)
+                hits = [by_lower[key] for key in difflib.get_close_matches(lower, by_lower, n=2, cutoff=cutoff)
+                        if DIGITS_PATTERN.findall(key) == digits]
+        matched.extend(hit for hit in hits if hit not in matched)
+    return matched
+
+
+def neighbours(routers: List[str], links: List[Dict[str, str]], hops: int) -> List[str]:
+    """
+    Routers within `hops` links of the given ones, nearest first, excluding the given ones.
+    """
+    adjacency: Dict[str, List[str]] = {}
+    for link in links:
+        adjacency.setdefault(link["from"], []).append(link["to"])
+        adjacency.setdefault(link["to"], []).append(link["from"])
+
+    seen = set(routers)
+    found = []
+    queue = deque((router, 0) for router in routers)
+    while queue:
+        router, depth = queue.popleft()
+        if depth == hops:
+            continue
+        for neighbour in sorted(adjacency.get(router, [])):
+            if neighbour not in seen:
+                seen.add(neighbour)
+                found.append(neighbour)
+                queue.append((neighbour, depth + 1))
+    return found
+
+
+def full_lists_fit(model, token_budget: int | None = None) -> bool:
+    """
+    Whether the network's full router and label lists go into prompts as
+    they are: they are within full_list_max_tokens, and within token_budget
+    if one is given. Does not depend on the description.
+    """
+    settings = get_config_section("prompt_context", CONTEXT_DEFAULTS)
+    limit = settings["full_list_max_tokens"]
+    if token_budget is not None:
+        limit = min(limit, token_budget)
+    return estimate_tokens(", ".join(model.routers)) + estimate_tokens(", ".join(model.labels)) <= limit
+
+
+def select_network_context(description: str, model, token_budget: int | None = None) -> NetworkContext:
+    """
+    Picks the routers and labels relevant to the description: routers it
+    names (fuzzy), labels it names, the named routers' topology neighbours
+    and the labels used at the named routers, in that order of priority,
+    cut off at the token budget. Networks whose full lists are within full_list_max_tokens
+    (and within token_budget, if given) are passed through unpruned.
+    Numbers that count failures, hops etc. are not matched. Settings come
+    from the "prompt_context" section of config.json.
+    """
+    settings = get_config_section("prompt_context", CONTEXT_DEFAULTS)
+    budget = settings["token_budget"] if token_budget is None else token_budget
+    full_tokens = estimate_tokens(", ".join(model.routers)) + estimate_tokens(", ".join(model.labels))
+    stats = {
+        "routers_total": len(model.routers),
+        "labels_total": len(model.labels),
+        "tokens_full": full_tokens,
+    }
+
+    if full_lists_fit(model, token_budget):
+        return NetworkContext(list(model.routers), list(model.labels), {
+            **stats, "routers_included": len(model.routers), "labels_included": len(model.labels),
+            "tokens_included": full_tokens
+        })
+
+    words = WORD_PATTERN.findall(QUANTITY_PATTERN.sub(" ", description))
+    named = match_routers(words, model.routers, settings["fuzzy_cutoff"])
+    nearby = neighbours(named, model.links, settings["neighbour_hops"])
+
+    label_set = set(model.labels)
+    named_labels = [word for word in dict.fromkeys(words) if word in label_set]
+    router_labels = [label for router in named for label in model.router_labels.get(router, [])]
+
+    # Fill the budget in order of relevance: what the description names
+    # first, then what is adjacent to it.
+    routers, labels, used = [], [], 0
+    groups = [
+        (routers, named),
+        (labels, named_labels),
+        (routers, nearby),
+        (labels, router_labels),
+    ]
+    for target, items in groups:
+        for item in items:
+            if item in target:
+                continue
+            cost = estimate_tokens(item) + 1  # ", " separator
+            if used + cost > budget:
+                break
+            target.append(item)
+            used += cost
+
+    return NetworkContext(routers, labels, {
+        **stats, "routers_included": len(routers), "labels_included": len(labels),
+        "tokens_included": estimate_tokens(", ".join(routers)) + estimate_tokens(", ".join(labels))
+    })
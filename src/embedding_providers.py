@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from typing import Dict, List
+
+from call_policy import call_with_policy
+from config import get_config_section
+from lazy_import import lazy_import
+from llm_client import backend_tag, get_openai_client
+
+np = lazy_import("numpy")
+
+EMBEDDING_PROVIDER_DEFAULTS = {
+    "provider": "openai",
+    "model": "text-embedding-3-small",
+    "local": {
+        "dim": 1024,
+        "ngram_min": 3,
+        "ngram_max": 5
+    }
+}
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into float32 vectors. `name` identifies the vector space and
+    is part of every cache and index key; `cacheable` says whether vectors are
+    worth caching on disk (remote calls) or cheaper to recompute.
+    """
+    name: str = ""
+    cacheable: bool = True
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    cacheable = True
+
+    def __init__(self, model: str = "text-embedding-3-small"):
+        self.model = model
+        tag = backend_tag()
+        self.name = f"{model}@{tag}" if tag else model
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        response = call_with_policy("embeddings", lambda timeout: get_openai_client().embeddings.create(
+            model=self.model,
+            input=texts,
+            timeout=timeout
+        ))
+        data = sorted(response.data, key=lambda item: item.index)
+        return np.array([item.embedding for item in data], dtype=np.float32)
+
+
+class HashedNgramEmbeddingProvider(EmbeddingProvider):
+    """
+    Offline embeddings: character n-grams of the lowercased text are hashed
+    into `dim` signed buckets, counts are damped with log1p and each vector
+    is L2-normalized. Hashing runs as NumPy array operations over the whole
+    batch at once; no vocabulary or corpus statistics are kept, so a text
+    always maps to the same vector.
+    """
+    cacheable = False
+
+    _PRIME = 16777619
+    _MASK = 0xFFFFFFFF
+
+    def __init__(self, dim: int = 1024, ngram_min: int = 3, ngram_max: int = 5):
+        self.dim = dim
+        self.ngram_min = ngram_min
+        self.ngram_max = ngram_max
+        self.name = f"hashed-ngram-{ngram_min}-{ngram_max}-d{dim}"
+
+    def _mix(self, h: np.ndarray) -> np.ndarray:
+        # 32-bit murmur3 finalizer, spreads the polynomial hash over all bits.
+        h ^= h >> np.uint64(16)
+        h = (h * np.uint64(0x85EBCA6B)) & self._MASK
+        h ^= h >> np.uint64(13)
+        h = (h * np.uint64(0xC2B2AE35)) & self._MASK
+        h ^= h >> np.uint64(16)
+        return h
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return vectors
+
+        docs = [f" {' '.join(text.lower().split())} " for text in texts]
+        lengths = np.array([len(doc) for doc in docs])
+        codes = np.frombuffer("".join(docs).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        doc_ids = np.repeat(np.arange(len(docs)), lengths)
+
+        for n in range(self.ngram_min, self.ngram_max + 1):
+            count = len(codes) - n + 1
+            if count <= 0:
+                continue
+            h = np.full(count, n, dtype=np.uint64)
+            for offset in range(n):
+                h = (h * self._PRIME + codes[offset:offset + count]) & self._MASK
+            # Only n-grams that start and end in the same document.
+            inside = doc_ids[:count] == doc_ids[n - 1:n - 1 + count]
+            h = self._mix(h[inside])
+            buckets = (h % np.uint64(self.dim)).astype(np.int64)
+            signs = np.where(h >> np.uint64(31), -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors, (doc_ids[:count][inside], buckets), signs)
+
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+_providers: Dict[str, EmbeddingProvider] = {}
+
+
+def get_embedding_provider(model: str | None = None) -> EmbeddingProvider:
+    """
+    Returns the embedding provider for `model`. None selects the provider
+    configured in the "embeddings" section of config.json ("openai" or
+    "local"); any other string is taken as an OpenAI embedding model name.
+    """
+    settings = get_config_section("embeddings", EMBEDDING_PROVIDER_DEFAULTS)
+    if settings["provider"] == "local":
+        local = {**EMBEDDING_PROVIDER_DEFAULTS["local"], **settings.get("local", {})}
+        configured = HashedNgramEmbeddingProvider(local["dim"], local["ngram_min"], local["ngram_max"])
+    elif settings["provider"] == "openai":
+        configured = OpenAIEmbeddingProvider(settings["model"])
+    else:
+        raise ValueError(f"Unknown embedding provider: {settings['provider']}")
+
+    if model is None or model == configured.name:
+        provider = configured
+    elif model in _providers:
+        provider = _providers[model]
+    else:
+        provider = OpenAIEmbeddingProvider(model)
+
+    # One instance per vector space, shared by all callers.
+    return _providers.setdefault(provider.name, provider)
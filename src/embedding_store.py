@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, List
+
+from filelock import FileLock
+
+from lazy_import import lazy_import
+
+np = lazy_import("numpy")
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Append-only embedding cache on disk.
+
+    <base>.f32         float32 vectors, one row per entry, row-major
+    <base>.keys.jsonl  one {"key", "text"} line per row, in row order
+    <base>.meta.json   {"dim": ..., "dtype": "float32"}
+
+    Vectors are memory-mapped, so loading costs neither parsing nor a copy,
+    and appending only writes the new rows. A row counts as stored once both
+    its vector and its key line are on disk; a torn append is cut off again
+    by the next writer.
+    """
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self.vectors_path = base_path + ".f32"
+        self.keys_path = base_path + ".keys.jsonl"
+        self.meta_path = base_path + ".meta.json"
+        self._file_lock = FileLock(base_path + ".lock")
+        self._lock = threading.RLock()
+        self.dim: int | None = None
+        self._texts: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._keys_offset = 0
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_path)
+
+    def refresh(self):
+        """
+        Picks up rows appended since the last refresh, by this or another process.
+        """
+        with self._lock:
+            if not self.exists():
+                return
+            if self.dim is None:
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    self.dim = int(json.load(f)["dim"])
+
+            if os.path.exists(self.keys_path) and os.path.getsize(self.keys_path) > self._keys_offset:
+                with open(self.keys_path, "rb") as f:
+                    f.seek(self._keys_offset)
+                    for raw in f:
+                        if not raw.endswith(b"\n"):
+                            break  # line still being written
+                        entry = json.loads(raw)
+                        self._rows.setdefault(entry["key"], len(self._texts))
+                        self._texts.append(entry["text"])
+                        self._keys_offset += len(raw)
+
+            row_bytes = self.dim * 4
+            vector_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+            rows = min(len(self._texts), vector_rows)
+            if rows != self._matrix.shape[0]:
+                if rows == 0:
+                    self._matrix = np.empty((0, self.dim), dtype=np.float32)
+                else:
+                    self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    def __len__(self) -> int:
+        return self._matrix.shape[0]
+
+    def __contains__(self, text: str) -> bool:
+        row = self._rows.get(text_key(text))
+        return row is not None and row < len(self)
+
+    def get(self, text: str) -> np.ndarray | None:
+        row = self._rows.get(text_key(text))
+        if row is None or row >= len(self):
+            return None
+        return self._matrix[row]
+
+    def texts(self) -> List[str]:
+        return self._texts[:len(self)]
+
+    def matrix(self, texts: List[str] | None = None) -> np.ndarray:
+        """
+        Returns the vectors of the given texts (all rows if None) as a float32
+        matrix. If the texts occupy consecutive rows in order, this is a view
+        of the memory map and no data is copied.
+        """
+        if texts is None:
+            return self._matrix
+        rows = [self._rows[text_key(text)] for text in texts]
+        if rows and rows == list(range(rows[0], rows[0] + len(rows))):
+            return self._matrix[rows[0]:rows[0] + len(rows)]
+        return np.ascontiguousarray(self._matrix[rows])
+
+    def append(self, texts: Iterable[str], vectors):
+        """
+        Appends the embeddings of texts that are not stored yet.
+        """
+        texts = list(texts)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        if not texts:
+            return
+
+        with self._lock, self._file_lock:
+            if not self.exists():
+                os.makedirs(os.path.dirname(self.meta_path) or ".", exist_ok=True)
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": int(vectors.shape[1]), "dtype": "float32"}, f)
+            self.refresh()
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.dim}.")
+
+            # Drop a torn append of an earlier writer before adding rows.
+            rows = len(self)
+            if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) != rows * self.dim * 4:
+                os.truncate(self.vectors_path, rows * self.dim * 4)
+            if len(self._texts) != rows:
+                with open(self.keys_path, "rb+") as f:
+                    f.truncate(self._keys_line_offset(rows))
+                del self._texts[rows:]
+                self._rows = {key: row for key, row in self._rows.items() if row < rows}
+                self._keys_offset = os.path.getsize(self.keys_path)
+
+            new_texts, new_rows, seen = [], [], set()
+            for text, vector in zip(texts, vectors):
+                key = text_key(text)
+                if key in self._rows or key in seen:
+                    continue
+                seen.add(key)
+                new_texts.append(text)
+                new_rows.append(vector)
+            if not new_texts:
+                return
+
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.vstack(new_rows).astype(np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.keys_path, "a", encoding="utf-8", newline="\n") as f:
+                for text in new_texts:
+                    f.write(json.dumps({"key": text_key(text), "text": text}, ensure_ascii=False) + "\n")
+            self.refresh()
+
+    def _keys_line_offset(self, rows: int) -> int:
+        offset = 0
+        with open(self.keys_path, "rb") as f:
+            for _ in range(rows):
+                offset += len(f.readline())
+        return offset
+
+
+_stores: Dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def store_base_path(cache_file: str) -> str:
+    base, ext = os.path.splitext(cache_file)
+    return base if ext == ".json" else cache_file
+
+
+def open_embedding_store(cache_file: str) -> EmbeddingStore:
+    """
+    Returns the process-wide store for a cache path such as
+    "embeddings/examples.json". If only the legacy JSON dictionary exists,
+    it is migrated into the binary store once.
+    """
+    base_path = store_base_path(os.path.abspath(cache_file))
+    with _stores_lock:
+        store = _stores.get(base_path)
+        if store is None:
+            store = EmbeddingStore(base_path)
+            _stores[base_path] = store
+
+    if not store.exists():
+        legacy_path = base_path + ".json"
+        with store._file_lock:
+            migrate = not store.exists() and os.path.exists(legacy_path)
+        if migrate:
+            with open(legacy_path, "r") as f:
+                legacy = json.load(f)
+            if legacy:
+                print(f"[i] Migrating {len(legacy)} embeddings from {legacy_path} to {base_path}.f32")
+                store.append(legacy.keys(), list(legacy.values()))
+
+    store.refresh()
+    return store
@@ -0,0 +1,31 @@
+import importlib
+from types import ModuleType
+
+
+class LazyModule:
+    """
+    Stands in for a module that is imported on first attribute access, so
+    heavy dependencies (faiss, numpy, ...) only cost import time in code
+    paths that use them. Python's import lock makes the first access
+    thread-safe.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: ModuleType | None = None
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
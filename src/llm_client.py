@@ -0,0 +1,70 @@
+import os
+import re
+import threading
+from urllib.parse import urlparse
+
+from config import get_config_section
+
+LLM_BACKEND_DEFAULTS = {
+    "base_url": None,
+    "stub": {
+        "host": "127.0.0.1",
+        "port": 8765,
+        "mode": "stub",
+        "fixtures": "run/llm_fixtures.jsonl",
+        "upstream": "https://api.openai.com/v1",
+        "embedding_dim": 1536,
+        "latency_ms": 0,
+        "jitter_ms": 0,
+        "token_latency_ms": 0
+    }
+}
+
+# Sent to local backends that do not check keys.
+LOCAL_API_KEY = "local"
+
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def get_base_url() -> str | None:
+    """
+    The OpenAI-compatible endpoint to talk to: OPENAI_BASE_URL if set,
+    else "base_url" in the "llm_backend" section of config.json, else None
+    for the OpenAI API.
+    """
+    return os.getenv("OPENAI_BASE_URL") or get_config_section("llm_backend", LLM_BACKEND_DEFAULTS)["base_url"]
+
+
+def backend_tag() -> str | None:
+    """
+    A file-name safe tag of the configured base URL ("127.0.0.1-8765"), or
+    None for the OpenAI API. Cached vectors and answers carry it, so results
+    of a stub or local backend never mix with real ones.
+    """
+    base_url = get_base_url()
+    if not base_url:
+        return None
+    return re.sub(r"[^\w.-]+", "-", urlparse(base_url).netloc or base_url).strip("-")
+
+
+def get_openai_client():
+    """
+    Creates the OpenAI client on first use, so modules that only embed
+    locally never need an API key. A configured base URL (e.g. the local
+    stub server) works without a key.
+    """
+    global _openai_client
+    with _openai_client_lock:
+        if _openai_client is None:
+            from dotenv import load_dotenv
+            from openai import OpenAI
+
+            load_dotenv()
+            base_url = get_base_url()
+            api_key = os.getenv("OPENAI_API_KEY") or (LOCAL_API_KEY if base_url else None)
+            if not api_key:
+                raise EnvironmentError("❌ OPENAI_API_KEY is not set or not found in .env")
+            # Retries are left to call_policy, which also enforces deadlines.
+            _openai_client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        return _openai_client
@@ -1,48 +1,215 @@
-from prompt_builder import regenerate_full_query_until_valid
+from prompt_builder import regenerate_full_query_until_valid, generate_valid_query
 from network_parser import load_network_model
-import subprocess
+from rag_network import record_validated_query
+from query_parser import find_query
+from config import get_config_section
+from aalwines_runner import AalwinesPool, get_aalwines_pool
+import argparse
 import json
 import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-def windows_to_wsl_path(path: str) -> str:
-    drive, rest = os.path.splitdrive(os.path.abspath(path))
-    drive_letter = drive.rstrip(':').lower()
-    return f"/mnt/{drive_letter}{rest.replace('\\', '/')}"
-
-def get_aalwines_bin():
-    if os.path.exists("config.json"):
-        with open("config.json", "r") as f:
-            config = json.load(f)
-            path = config.get("aalwines_bin_path")
-            return path
-
-    raise FileNotFoundError("AalWiNes binary not found. Please set AALWINES_BIN or config.json.")
-
-
-def run_aalwines(query: str, network_path: str, weight_path: str, query_path: str):
-    # Save query file in Windows
-    with open(query_path, 'w', encoding='utf-8') as f:
-        f.write(query)
-
-    # Convert to WSL-style paths
-    network_path_wsl = windows_to_wsl_path(network_path)
-    weight_path_wsl = windows_to_wsl_path(weight_path)
-    query_path_wsl = windows_to_wsl_path(query_path)
-
-    # AalWiNes binary inside WSL
-    aalwines_bin = get_aalwines_bin()
-    command = f"wsl {aalwines_bin} --input {network_path_wsl} -w {weight_path_wsl} -q {query_path_wsl} --trace 1 -e 1"
-    
-    result = subprocess.run(command, capture_output=True, text=True, shell=True)
-    
-    if result.returncode == 0:
-        trace_output = result.stdout
-        return True, trace_output
-    else:
-        print(f"AalWiNes error:\n{result.stderr}")
-        return False, result.stderr
+BATCH_DEFAULTS = {
+    "llm_workers": 4,
+    "aalwines_workers": 2,
+    "queries_per_run": 8,
+    "weight_path": "run/Agis-weight.json"
+}
+
+def load_batch_records(path: str):
+    """
+    Yields (record_id, record, error) for each JSONL line with a
+    "description" and a "network" (file in networks/) and an optional "k".
+    The id is the record's "id" field if present, otherwise its line number.
+    For a line that is not such a record, record is None and error says why.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield str(line_number), None, f"line {line_number}: invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield str(line_number), None, f"line {line_number}: expected a JSON object"
+                continue
+            missing = [field for field in ("description", "network") if not record.get(field)]
+            if missing:
+                yield str(record.get("id", line_number)), None, f"line {line_number}: missing {', '.join(missing)}"
+                continue
+            yield str(record.get("id", line_number)), record, None
+
+# Result statuses that end a record; records that only have error lines
+# (generate_error, run_error) are retried on resume.
+TERMINAL_STATUSES = ("ok", "generated", "aalwines_failed")
+
+def completed_record_ids(output_path: str):
+    """
+    Ids of the records that already have a result line with a terminal
+    status. A torn last line (from an interrupted run) does not count.
+    """
+    done = set()
+    if os.path.exists(output_path):
+        with open(output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                    if result["status"] in TERMINAL_STATUSES:
+                        done.add(result["id"])
+                except (json.JSONDecodeError, KeyError):
+                    continue
+    return done
+
+_batch_models = {}
+_batch_models_lock = threading.Lock()
+
+def _batch_model(network: str):
+    with _batch_models_lock:
+        if network not in _batch_models:
+            _batch_models[network] = load_network_model(os.path.join("networks", network))
+        return _batch_models[network]
+
+def _generate_for_record(record):
+    start = time.perf_counter()
+    model = _batch_model(record["network"])
+    query, stats = generate_valid_query(record["description"], model)
+    if record.get("k") is not None:
+        parsed = find_query(query)
+        parsed.k = int(record["k"])
+        query = parsed.format()
+    return query, stats, time.perf_counter() - start
+
+def run_batch(input_path: str, output_path: str, llm_workers: int, aalwines_workers: int,
+              weight_path: str, execute: bool = True, resume: bool = True, queries_per_run: int | None = None):
+    """
+    Generates (and with execute, runs) a query for every record of the
+    JSONL input. LLM generation and AalWiNes runs have their own worker
+    pools (an AalwinesPool of aalwines_workers processes). Queries that
+    become ready together are run as soon as possible, those for the same
+    network in one AalWiNes invocation of up to queries_per_run queries.
+    One JSON line per record is appended to output_path as it completes,
+    with the status, query, generation stats and per-stage timings. With
+    resume, records that already have a terminal result line are skipped.
+    Input lines that are not valid records get an "invalid_record" line.
+    """
+    queries_per_run = max(1, queries_per_run or get_config_section("batch", BATCH_DEFAULTS)["queries_per_run"])
+    done = completed_record_ids(output_path) if resume else set()
+    records = [entry for entry in load_batch_records(input_path) if entry[0] not in done]
+    if done:
+        print(f"[i] Resuming: {len(done)} record(s) already done, {len(records)} to go.")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    counts = {}
+    run_pool = AalwinesPool(aalwines_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=llm_workers) as llm_pool, \
+                open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+
+            def finish(result, queued):
+                result["timings"]["total_s"] = time.perf_counter() - queued
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+                print(f"[{sum(counts.values())}/{len(records)}] {result['id']}: {result['status']}")
+
+            pending = {}
+            for record_id, record, error in records:
+                if error is not None:
+                    finish({"id": record_id, "status": "invalid_record", "error": error, "timings": {}}, time.perf_counter())
+                    continue
+                result = {"id": record_id, "description": record.get("description"), "network": record.get("network"),
+                          "k": record.get("k"), "timings": {}}
+                pending[llm_pool.submit(_generate_for_record, record)] = ("generate", [(result, record, time.perf_counter())])
+
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                ready = {}
+                for future in finished:
+                    stage, items = pending.pop(future)
+                    if stage == "generate":
+                        result, record, queued = items[0]
+                        try:
+                            result["query"], result["stats"], result["timings"]["generate_s"] = future.result()
+                        except Exception as e:
+                            result["status"] = "generate_error"
+                            result["error"] = f"{type(e).__name__}: {e}"
+                            finish(result, queued)
+                            continue
+                        if execute:
+                            ready.setdefault(record["network"], []).append(items[0])
+                            continue
+                        result["status"] = "generated"
+                        finish(result, queued)
+                        continue
+
+                    try:
+                        outcomes = future.result()
+                        error = None
+                    except Exception as e:
+                        outcomes, error = [None] * len(items), e
+                    for (result, record, queued), outcome in zip(items, outcomes):
+                        if error is not None:
+                            result["status"] = "run_error"
+                            result["error"] = f"{type(error).__name__}: {error}"
+                            finish(result, queued)
+                            continue
+                        success, output = outcome
+                        result["timings"]["run_queue_s"] = future.job.wait_seconds
+                        result["timings"]["run_s"] = future.job.run_seconds
+                        result["timings"]["run_batch_size"] = len(items)
+                        result["aalwines_status"] = outcome.status
+                        # A k override makes the query differ from what the description asks for;
+                        # timeouts and OOMs say nothing about the query's validity.
+                        if record.get("k") is None and outcome.status in ("ok", "error"):
+                            record_validated_query(record["description"], _batch_model(record["network"]),
+                                                   result["query"], success)
+                        result["status"] = "ok" if success else "aalwines_failed"
+                        result["aalwines_output"] = output
+                        finish(result, queued)
+
+                for network, items in ready.items():
+                    network_path = os.path.join("networks", network)
+                    for i in range(0, len(items), queries_per_run):
+                        chunk = items[i:i + queries_per_run]
+                        future = run_pool.submit_batch([result["query"] for result, _, _ in chunk], network_path, weight_path)
+                        pending[future] = ("run", chunk)
+    finally:
+        # Nothing is queued after a normal run; after an error, queued runs
+        # are dropped and running ones end within their deadline.
+        run_pool.shutdown(cancel_pending=True)
+    metrics = run_pool.metrics()
+    if metrics["run_time"]["count"]:
+        print(f"[i] AalWiNes runs: {metrics['run_time']['count']} for {metrics['queries']} queries, p50 {metrics['run_time']['p50_ms']} ms, "
+              f"p95 {metrics['run_time']['p95_ms']} ms, mean queue wait {metrics['wait_time']['mean_ms']} ms")
+    print(f"[✓] Batch finished: {', '.join(f'{n} {status}' for status, n in sorted(counts.items())) or 'nothing to do'}.")
+    return counts
 
 def main():
+    sys.stdout.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description="AalWiNes query generator (interactive, or batch over a JSONL file).")
+    parser.add_argument("--batch", metavar="INPUT", help="JSONL file of {description, network, k?} records")
+    parser.add_argument("--output", default="results/batch_results.jsonl", help="JSONL results, appended to")
+    parser.add_argument("--llm-workers", type=int, default=BATCH_DEFAULTS["llm_workers"])
+    parser.add_argument("--aalwines-workers", type=int, default=BATCH_DEFAULTS["aalwines_workers"])
+    parser.add_argument("--queries-per-run", type=int, default=BATCH_DEFAULTS["queries_per_run"],
+                        help="queries of the same network batched into one AalWiNes invocation")
+    parser.add_argument("--weights", default=BATCH_DEFAULTS["weight_path"], help="weight file for AalWiNes runs")
+    parser.add_argument("--no-run", action="store_true", help="only generate queries, do not run AalWiNes")
+    parser.add_argument("--restart", action="store_true", help="overwrite the output instead of resuming")
+    settings = get_config_section("batch", BATCH_DEFAULTS)
+    parser.set_defaults(llm_workers=settings["llm_workers"], aalwines_workers=settings["aalwines_workers"],
+                        queries_per_run=settings["queries_per_run"], weights=settings["weight_path"])
+    args = parser.parse_args()
+    if args.batch:
+        run_batch(args.batch, args.output, args.llm_workers, args.aalwines_workers, args.weights,
+                  execute=not args.no_run, resume=not args.restart, queries_per_run=args.queries_per_run)
+        return
+
     print("AalWiNes Query Generator\n")
 
     model = None
@@ -61,9 +228,8 @@ def main():
         except Exception as e:
             print(f"Error: {e}. Please try again.\n")
 
-    # Use static paths for weight + query files (adjust if needed)
+    # Use a static weight file (adjust if needed); every run gets its own query file.
     weight_path = "run/Agis-weight.json"
-    query_path = "run/Agis-query.q"
 
     while True:
         try:
@@ -73,11 +239,21 @@ def main():
             if desc.lower() == "exit":
                 break
 
+            original_desc = desc
             query = regenerate_full_query_until_valid(desc, model)
             print(f"[Generated query]:\n{query}")
             MAX_RETRIES = 2
             for attempt in range(MAX_RETRIES):
-                success, result = run_aalwines(query, model_path, weight_path, query_path)
+                pool = get_aalwines_pool()
+                future = pool.submit(query, model_path, weight_path)
+                try:
+                    outcome = future.result()
+                except KeyboardInterrupt:
+                    pool.cancel(future)
+                    raise
+                success, result = outcome
+                if outcome.status in ("ok", "error"):
+                    record_validated_query(original_desc, model, query, success)
                 if success:
                     print(result.strip())
                     print("[✓] AalWiNes executed successfully.")
@@ -91,7 +267,7 @@ def main():
                         f"Original description: {desc}\n"
                         f"Regenerate the query based on the error: {result.strip()}\n"
                     )
-                    query = regenerate_full_query_until_valid(desc, model)
+                    query = regenerate_full_query_until_valid(desc, model, use_semantic_cache=False)
                     print(f"[↻] New query:\n{query}\n")
                 else:
                     print("[✗] Failed after multiple attempts.")
@@ -1,11 +1,19 @@
+import hashlib
 import json
+import os
 
 class NetworkModel:
-    def __init__(self, routers, links, labels, atoms):
+    def __init__(self, routers, links, labels, atoms, router_labels=None, name=None, fingerprint=None):
         self.routers = routers
         self.links = links
         self.labels = labels
         self.atoms = atoms
+        # Labels appearing in each router's routing tables.
+        self.router_labels = router_labels or {}
+        # File name without extension and a hash of the file contents, to key
+        # per-network caches; None for models not loaded from a file.
+        self.name = name
+        self.fingerprint = fingerprint
 
     def __repr__(self):
         return (f"NetworkModel(routers={len(self.routers)}, "
@@ -13,8 +21,9 @@ class NetworkModel:
 
 
 def load_network_model(file_path: str) -> NetworkModel:
-    with open(file_path, 'r') as f:
-        data = json.load(f)
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    data = json.loads(raw)
 
     network = data.get("network", {})
     routers = [r["name"] for r in network.get("routers", []) if "name" in r]
@@ -23,20 +32,26 @@ def load_network_model(file_path: str) -> NetworkModel:
 
     labels = set()
     atoms = set()
+    router_labels = {}
 
     for router in network.get("routers", []):
         router_name = router["name"]
         for interface in router.get("interfaces", []):
             for label, entries in interface.get("routing_table", {}).items():
                 labels.add(str(label))
+                router_labels.setdefault(router_name, set()).add(str(label))
                 for entry in entries:
                     atoms.add(f"{router_name}#{entry['out']}")
 
+    label_order = lambda x: (not x.isdigit(), x)
     return NetworkModel(
         routers=sorted(routers),
         links=links,
-        labels=sorted(labels, key=lambda x: (not x.isdigit(), x)),
-        atoms=sorted(atoms)
+        labels=sorted(labels, key=label_order),
+        atoms=sorted(atoms),
+        router_labels={name: sorted(found, key=label_order) for name, found in router_labels.items()},
+        name=os.path.splitext(os.path.basename(file_path))[0],
+        fingerprint=hashlib.sha256(raw).hexdigest()[:16]
     )
 
 
@@ -1,32 +1,127 @@
-import re
-from query_formatter import is_valid_label, is_valid_path_format
-from rag_network import embed_examples, store_embeddings_in_faiss, search
-from openai import OpenAI
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from query_formatter import validate_query
+from query_parser import QuerySyntaxError, find_query
+from query_repair import REPAIR_DEFAULTS, repair_query
+from rag_network import ensure_example_index, lookup_validated_query, record_validated_query, search
+from caching import LRUCache, SQLiteCache, TieredCache
+from context_selector import full_lists_fit, select_network_context
+from config import get_config_section
+from call_policy import call_with_policy
+from token_accounting import token_usage
+from llm_client import backend_tag, get_openai_client
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-
-# Check for API key
-if not api_key:
-    raise EnvironmentError("OPENAI_API_KEY not set in environment variables.")
-
-client = OpenAI(api_key=api_key)
-
-def generate_query2(description, model, feedback=""):
-    prompt = build_prompt(description, model, feedback)
-    response = client.chat.completions.create(
-        model="gpt-4.1-mini-2025-04-14",
-        messages=[
-            {"role": "system", "content": "You are an assistant that generates valid AalWiNes query components."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.2
-    )
+
+LLM_MODEL = "gpt-4.1-mini-2025-04-14"
+
+RESPONSE_CACHE_DEFAULTS = {
+    "enabled": True,
+    "memory_maxsize": 512,
+    "path": "results/llm_cache.sqlite",
+    "max_bytes": 50_000_000
+}
+
+LLM_DEFAULTS = {
+    "candidates": 1,
+    "candidate_mode": "concurrent",
+    "max_rounds": 3
+}
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """
+    Returns the process-wide LLM response cache (memory LRU in front of a
+    SQLite file), or None if disabled in the "response_cache" section of
+    config.json.
+    """
+    global _response_cache
+    settings = get_config_section("response_cache", RESPONSE_CACHE_DEFAULTS)
+    if not settings["enabled"]:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            disk = SQLiteCache(settings["path"], settings["max_bytes"]) if settings["path"] else None
+            _response_cache = TieredCache(LRUCache(settings["memory_maxsize"]), disk)
+        return _response_cache
+
+def response_cache_key(llm_model, messages, temperature, feedback=""):
+    request = {"model": llm_model, "messages": messages, "temperature": temperature, "feedback": feedback}
+    tag = backend_tag()
+    if tag:
+        request["backend"] = tag
+    payload = json.dumps(request, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def chat_completion(messages, temperature, feedback="", use_cache=True, endpoint="chat", usage=None):
+    """
+    Returns the stripped completion text for the messages, or None if the
+    model returned nothing. Identical requests are answered from the
+    response cache unless use_cache is False; empty answers are not cached,
+    and neither are "query" completions, which generate_valid_query only
+    stores once they pass validation (see cache_validated_response).
+    Token counts are recorded under `endpoint` and added to the `usage`
+    dict if given.
+    """
+    cache = get_response_cache() if use_cache else None
+    key = response_cache_key(LLM_MODEL, messages, temperature, feedback)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    response = call_with_policy(endpoint, lambda timeout: get_openai_client().chat.completions.create(
+        model=LLM_MODEL,
+        messages=messages,
+        temperature=temperature,
+        timeout=timeout
+    ))
+    token_usage.record(endpoint, response.usage, into=usage)
     if not response.choices or not response.choices[0].message.content:
+        return None
+    content = response.choices[0].message.content.strip()
+    if cache is not None and endpoint != "query":
+        cache.put(key, content)
+    return content
+
+def cache_validated_response(messages, temperature, feedback, content):
+    """
+    Stores a query completion that passed validation, so the same request
+    is answered from the response cache next time.
+    """
+    cache = get_response_cache()
+    if cache is not None:
+        cache.put(response_cache_key(LLM_MODEL, messages, temperature, feedback), content)
+
+def discard_cached_response(messages, temperature, feedback, content):
+    """
+    Drops a cached completion that turned out to be invalid, if it is
+    still the cached answer to the request.
+    """
+    cache = get_response_cache()
+    if cache is not None:
+        key = response_cache_key(LLM_MODEL, messages, temperature, feedback)
+        if cache.get(key) == content:
+            cache.delete(key)
+
+
+QUERY_TEMPERATURE = 0.2
+
+def generate_query2(description, model, feedback="", use_cache=True):
+    content = chat_completion(
+        query_messages(description, model, feedback),
+        temperature=QUERY_TEMPERATURE,
+        feedback=feedback,
+        use_cache=use_cache,
+        endpoint="query"
+    )
+    if content is None:
         return "Error: No response from model."
-    return response.choices[0].message.content.strip()
+    return content
 
 aalwines_guide = """
 You are an expert on AalWiNes, a tool used for analyzing MPLS networks using a custom query language.
@@ -61,108 +156,241 @@ This query checks if a packet with only a label 10 can enter at any interface to
 Answer all user questions clearly, and if asked about AalWiNes or for a query, use the provided context and explain each part of the query.
 """
 
-def generate_answer(description):
-    response = client.chat.completions.create(
-        model="gpt-4.1-mini-2025-04-14",
-        messages=[
-            {"role": "system", "content": aalwines_guide},
-            {"role": "user", "content": description}
-        ],
-        temperature=0.5
+ANSWER_TEMPERATURE = 0.5
+
+def _answer_messages(description):
+    return [
+        {"role": "system", "content": aalwines_guide},
+        {"role": "user", "content": description}
+    ]
+
+def generate_answer(description, use_cache=True):
+    content = chat_completion(
+        _answer_messages(description),
+        temperature=ANSWER_TEMPERATURE,
+        use_cache=use_cache,
+        endpoint="answer"
     )
-    if not response.choices or not response.choices[0].message.content:
+    if content is None:
         return "Error: No response from model."
-    return response.choices[0].message.content.strip()
+    return content
+
+
+class AnswerStream:
+    """
+    Iterates over the text chunks of a chat answer as the model produces
+    them. Once iterated, `text` holds the complete answer,
+    `time_to_first_token` the seconds until the first chunk arrived and
+    `cached` whether it came from the response cache (in one chunk) and
+    `usage` the token counts of the request. Shares cache entries with
+    generate_answer.
+    """
+
+    def __init__(self, description, use_cache=True):
+        self.description = description
+        self.use_cache = use_cache
+        self.text = None
+        self.time_to_first_token = None
+        self.cached = False
+        self.usage = None
+
+    def __iter__(self):
+        start = time.perf_counter()
+        messages = _answer_messages(self.description)
+        cache = get_response_cache() if self.use_cache else None
+        key = response_cache_key(LLM_MODEL, messages, ANSWER_TEMPERATURE)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                self.cached = True
+                self.time_to_first_token = time.perf_counter() - start
+                self.text = cached
+                yield cached
+                return
+
+        # The deadline covers opening the stream; each chunk read has the same timeout.
+        stream = call_with_policy("answer", lambda timeout: get_openai_client().chat.completions.create(
+            model=LLM_MODEL,
+            messages=messages,
+            temperature=ANSWER_TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout
+        ), hedge=False)
+        parts = []
+        for chunk in stream:
+            # The last chunk carries the usage and no choices.
+            if getattr(chunk, "usage", None) is not None:
+                self.usage = token_usage.record("answer", chunk.usage)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - start
+            parts.append(delta)
+            yield delta
+
+        self.text = "".join(parts).strip()
+        if not self.text:
+            self.text = "Error: No response from model."
+            yield self.text
+        elif cache is not None:
+            cache.put(key, self.text)
+
+def generate_answer_stream(description, use_cache=True):
+    return AnswerStream(description, use_cache)
 
 
 def extract_parts(query: str):
+    """
+    Returns (start_label, path, end_label, k) of the query in a model
+    answer, or four Nones if it does not parse.
+    """
     try:
-        # Extract all <...> patterns including multiple labels inside
-        label_matches = re.findall(r"<([^<>]+)>", query)
-        k_matches = re.findall(r"\b\d+\b", query)
-
-        if len(label_matches) < 2 or not k_matches:
-            return None, None, None, None
-
-        start_label = f"<{label_matches[0]}>"
-        end_label = f"<{label_matches[1]}>"
-        k = k_matches[-1]
-
-        # Find everything between start_label and end_label
-        start_index = query.find(start_label)
-        end_index = query.find(end_label, start_index + len(start_label))
-        path_expr = query[start_index + len(start_label):end_index].strip()
-
-        return start_label, path_expr, end_label, k
-
-    except Exception as e:
-        print(f"[!] Error parsing query: {e}")
+        parsed = find_query(query)
+    except QuerySyntaxError:
         return None, None, None, None
-
-
-def regenerate_full_query_until_valid(desc, model):
-    max_attempts = 3
-    attempts = 0
+    return parsed.start_label, parsed.path_text, parsed.end_label, str(parsed.k)
+
+
+def check_query(query, model):
+    """
+    Validates a generated query. Returns (full_query, None) if it is valid,
+    otherwise (None, feedback) where feedback is the hint for the next
+    generation, or None if there is nothing specific to report.
+    """
+    if not query or not query.strip():
+        print("[!] Query is None or empty. Retrying...")
+        return None, None
+    try:
+        parsed = find_query(query)
+    except QuerySyntaxError as e:
+        print(f"[!] Query does not parse: {e}")
+        return None, f"The query {e.text} is malformed: {e}. Review the rules and generate a valid query.\n"
+
+    valid, error = validate_query(parsed, model)
+    if not valid:
+        return None, f"The query {parsed.format()} is incorrect: {error.rstrip('.')}. Review the rules and generate a valid query.\n"
+
+    return parsed.format("DUAL"), None
+
+
+def _generate_candidates(messages, feedback, candidates, mode, usage=None, use_cache=True):
+    """
+    Yields generated candidate queries as they become available.
+    "concurrent" sends `candidates` requests at once and yields in order of
+    arrival; "n" asks for all candidates in one request via the `n`
+    parameter. With use_cache, the first candidate may come from the
+    response cache, which only holds validated queries. Requests still
+    running when the consumer stops are abandoned. Token counts are added
+    to the `usage` dict if given.
+    """
+    if mode == "n":
+        response = call_with_policy("query", lambda timeout: get_openai_client().chat.completions.create(
+            model=LLM_MODEL,
+            messages=messages,
+            temperature=QUERY_TEMPERATURE,
+            n=candidates,
+            timeout=timeout
+        ))
+        token_usage.record("query", response.usage, into=usage)
+        for choice in response.choices:
+            yield (choice.message.content or "").strip() or "Error: No response from model."
+        return
+
+    pool = ThreadPoolExecutor(max_workers=candidates)
+    futures = [
+        pool.submit(chat_completion, messages, QUERY_TEMPERATURE, feedback, use_cache and i == 0, "query", usage)
+        for i in range(candidates)
+    ]
+    try:
+        for future in as_completed(futures):
+            try:
+                content = future.result()
+            except Exception as e:
+                print(f"[!] Candidate generation failed: {e}")
+                continue
+            yield content if content is not None else "Error: No response from model."
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def generate_valid_query(desc, model, candidates=None, mode=None, use_semantic_cache=True):
+    """
+    Generates queries until one passes check_query and returns
+    (query, stats). Each round draws `candidates` queries in parallel (see
+    _generate_candidates) and stops at the first valid one; the feedback of
+    the last invalid one goes into the next round. Defaults come from the
+    "llm" section of config.json. stats holds the number of rounds, the
+    candidates requested, the candidates validated until success, the
+    local repairs applied to the returned query (see query_repair) and the
+    tokens spent (prompt, of which served from the provider's prefix cache,
+    and completion). An invalid candidate is repaired locally before
+    another candidate or round is waited for. With use_semantic_cache, a
+    query validated for a near-identical description of the same network
+    is returned without calling the LLM (stats["semantic_cache_hit"]), and
+    new valid queries are stored for later descriptions (see rag_network).
+    """
+    settings = get_config_section("llm", LLM_DEFAULTS)
+    candidates = max(1, candidates or settings["candidates"])
+    mode = mode or settings["candidate_mode"]
     feedback = ""
-
-    while attempts < max_attempts:
-        query = generate_query2(desc, model, feedback)
-        print(f"[Try {attempts + 1}] Generated query: {query}")
-
-        start_label, path_expr, end_label, k = extract_parts(query)
-        if not start_label or not path_expr or not end_label or not k:
-            print("[!] Query is None or empty. Retrying...")
-            attempts += 1
-            continue
-        if not all([start_label, path_expr, end_label, k]):
-            print("[!] Query format incomplete. Retrying...")
-            attempts += 1
-            continue
-
-        if not is_valid_label(start_label.strip('<>'), model):
-            print(f"[!] Invalid start label: {start_label}")
-            feedback = f"Invalid start label: {start_label}"
-            attempts += 1
-            continue
-
-        if not is_valid_path_format(path_expr, model)[0]:
-            print(f"This path {path_expr} is incorrect: {is_valid_path_format(path_expr, model)[1]}")
-            feedback = f"This path {path_expr} is incorrect: {is_valid_path_format(path_expr, model)[1]}. Review the rules and generate a valid path.\n"
-            attempts += 1
-            continue
-
-        if not is_valid_label(end_label.strip('<>'), model):
-            print(f"[!] Invalid end label: {end_label}")
-            feedback = f"Invalid end label: {end_label}"
-            attempts += 1
-            continue
-
-        if not k.isdigit():
-            print(f"[!] Invalid k: {k}")
-            attempts += 1
-            continue
-
-        print(f"[✓] Valid full query after {attempts + 1} attempt(s).")
-        return f"{start_label} {path_expr} {end_label} {k} DUAL"
+    stats = {"rounds": 0, "candidates_requested": 0, "candidates_used": 0, "repairs": []}
+    usage = {}
+    repair = get_config_section("query_repair", REPAIR_DEFAULTS)["enabled"]
+
+    if use_semantic_cache:
+        cached = lookup_validated_query(desc, model)
+        if cached:
+            stats["semantic_cache_hit"] = True
+            return cached, stats
+
+    for round_number in range(1, settings["max_rounds"] + 1):
+        stats["rounds"] = round_number
+        stats["candidates_requested"] += candidates
+        round_feedback = feedback
+        messages = query_messages(desc, model, round_feedback)
+        # Only the first round may read the response cache; later rounds
+        # need fresh samples.
+        use_cache = round_number == 1
+        for query in _generate_candidates(messages, round_feedback, candidates, mode, usage, use_cache):
+            stats["candidates_used"] += 1
+            print(f"[Try {stats['candidates_used']}] Generated query: {query}")
+            full_query, new_feedback = check_query(query, model)
+            valid_text = query if full_query else None
+            if not full_query and repair:
+                repaired, repairs = repair_query(query, model, desc)
+                if repaired and repairs:
+                    full_query, _ = check_query(repaired, model)
+                    if full_query:
+                        print(f"[i] Repaired locally ({'; '.join(repairs)}): {repaired}")
+                        stats["repairs"] = repairs
+                        valid_text = repaired
+            if not full_query and use_cache:
+                discard_cached_response(messages, QUERY_TEMPERATURE, round_feedback, query)
+            if full_query:
+                cache_validated_response(messages, QUERY_TEMPERATURE, round_feedback, valid_text)
+                print(f"[✓] Valid full query after {stats['candidates_used']} candidate(s) in {round_number} round(s).")
+                stats.update(usage)
+                print(f"[i] Tokens: {usage.get('prompt_tokens', 0)} prompt ({usage.get('cached_tokens', 0)} cached), {usage.get('completion_tokens', 0)} completion.")
+                if use_semantic_cache:
+                    record_validated_query(desc, model, full_query)
+                return full_query, stats
+            if new_feedback:
+                feedback = new_feedback
 
     raise ValueError("Failed to generate a valid query.")
 
+def regenerate_full_query_until_valid(desc, model, candidates=None, use_semantic_cache=True):
+    return generate_valid_query(desc, model, candidates, use_semantic_cache=use_semantic_cache)[0]
 
-def build_prompt(description, model, feedback=""):
-    examples = load_examples()
-    chunks = ["".join(map(str, sublist)) for sublist in examples]
-    embedded = embed_examples(chunks, cache_file="embeddings/examples.json", model = "text-embedding-3-small")
-    store_embeddings_in_faiss(embedded)
-    top_chunks = search(f"Input: {description}", k=3)
-    retrieved_text = ""
-    for chunk in top_chunks:
-        retrieved_text += f"{chunk}\n"
-    
-    routers_text = ", ".join(model.routers)
-    
-    labels_text = ", ".join(model.labels)
 
-    return f"""
+# The query prompt is assembled from three parts, most stable first, so
+# providers can reuse cached prefixes across requests:
+#   1. QUERY_PROMPT_PREFIX: the fixed rules, identical for every request
+#   2. the network segment: routers and labels of the network
+#   3. the request suffix: retrieved examples, feedback and user input
+QUERY_PROMPT_PREFIX = """You are an assistant that generates valid AalWiNes query components.
+
 Context: How to Generate Valid AalWiNes Queries
 You are tasked with generating structured verification queries for a tool called AalWiNes. This tool performs what-if analysis in MPLS (Multiprotocol Label Switching) networks. Each query describes how packets are expected to move through a network from source to destination, possibly under link failure conditions. Accuracy in formatting and semantics is crucial. Here's what you must understand and follow:
 
@@ -176,7 +404,7 @@ Must describe the label stack before entering the network.
 
 Only allows:
 Single known labels (e.g. <500>)
-These are the labels that you are allowed to use: Either the wildcard, if no label is specified <.*> or these {labels_text}
+These are the labels that you are allowed to use: Either the wildcard, if no label is specified <.*> or the labels listed under "Network labels" in the network section
 Space-separated lists of such labels (e.g. <250 10>)
 Optional suffixes: *, +, ? (e.g. <68843*>, <10000?>)
 Always use the wildcard <.*> if no label is specified by the user
@@ -197,7 +425,7 @@ Path must:
 Start with [.#Router]
 End with [Router#.]
 Use only [.#Router] for intermediate hops
-Only use the following router names if specified by the user: {routers_text}
+Only use the router names listed under "Network routers" in the network section, if specified by the user
 If no router names are specified, use the dot to represent one wildcard router.
 If the user input requests a number of hops (e.g., “three or more hops”), express this as ...(.)*  that is, one dot per required hop, followed by (.)* if more hops are allowed. Make sure to check the number of hops that the user asks.
 
@@ -207,7 +435,7 @@ Negation with [^...] is allowed for blocks
 
 3. <end_label>:
 Same rules as for <start_label>.
-These are the labels that you are allowed to use: Either the wildcard, if no label is specified <.*> or these {labels_text}
+These are the labels that you are allowed to use: Either the wildcard, if no label is specified <.*> or the labels listed under "Network labels" in the network section
 Reflects the label stack expected when exiting the network.
 
 4. <max_link_failures>:
@@ -229,23 +457,104 @@ Refer to sample router names or labels always when provided by the user.
 Try to model realistic network movement: enter a router, transit through the network, exit from another.
 Be consistent in formatting: always use <start_label> <path_expression> <end_label> <max_link_failures>
 
+Do not output anything else than the query in the format:
+<start_label> <path_expression> <end_label> <max_link_failures>
+
+Do not output any explanation, just the query.
+"""
+
+
+def build_network_segment(model):
+    """
+    The per-network part of the prompt. It does not depend on the request,
+    so requests on the same network share it as cacheable prefix: the full
+    router and label lists, or for networks too large to list, their size
+    and where the relevant routers and labels are given instead.
+    """
+    if full_lists_fit(model):
+        return f"""Network routers: {", ".join(model.routers)}
+Network labels: {", ".join(model.labels)}
+"""
+    return f"""Network size: {len(model.routers)} routers, {len(model.labels)} labels. Only the routers and labels relevant to the user input are listed, under "Network routers" and "Network labels" before the examples.
+"""
+
 
+def build_network_selection(description, model):
+    """
+    The routers and labels relevant to the description, for networks whose
+    full lists are not in the network segment; empty otherwise. It goes at
+    the start of the request suffix, after the cacheable prefix.
+    """
+    if full_lists_fit(model):
+        return ""
+    context = select_network_context(description, model)
+    print(f"[i] Pruned network context for prompt: {context}")
+    routers_text = ", ".join(context.routers) or "(no router of this network matches the user input)"
+    labels_text = ", ".join(context.labels) or "(no label of this network matches the user input)"
+    return f"""
+Network routers: {routers_text}
+Network labels: {labels_text}
+"""
+
+
+def build_request_suffix(description, feedback=""):
+    chunks = load_example_chunks()
+    index_path, metadata_path = ensure_example_index(chunks, cache_file="embeddings/examples.json")
+    top_chunks = search(f"Input: {description}", index_path=index_path, metadata_path=metadata_path, k=3)
+    retrieved_text = ""
+    for chunk in top_chunks:
+        retrieved_text += f"{chunk}\n"
+
+    return f"""
 Use these examples to generate the AalWiNes query:
 {retrieved_text}
 
 Please generate the query and do exactly like the examples suggest just with consideration of user input.
 {feedback}
 
-Do not output anything else than the query in the format:
-<start_label> <path_expression> <end_label> <max_link_failures>
-
-Do not output any explanation, just the query.
-
 User Input: {description}
 Query:
 """
 
 
+def build_prompt_parts(description, model, feedback=""):
+    """
+    Returns (prefix, network segment, request suffix) of the query prompt.
+    Only the request suffix depends on the description.
+    """
+    request_suffix = build_network_selection(description, model) + build_request_suffix(description, feedback)
+    return QUERY_PROMPT_PREFIX, build_network_segment(model), request_suffix
+
+
+def build_prompt(description, model, feedback=""):
+    return "\n".join(build_prompt_parts(description, model, feedback))
+
+
+def query_messages(description, model, feedback=""):
+    """
+    Chat messages for a query generation: the fixed prefix as system
+    message, network segment and request suffix as user message.
+    """
+    prefix, network_segment, request_suffix = build_prompt_parts(description, model, feedback)
+    return [
+        {"role": "system", "content": prefix},
+        {"role": "user", "content": network_segment + request_suffix}
+    ]
+
+
+_example_chunks = None
+
+def load_example_chunks(filepath="run/examples.txt"):
+    """
+    The examples as "Input: ... REGEX: ..." chunks, re-read only when the file changes.
+    """
+    global _example_chunks
+    mtime = os.stat(filepath).st_mtime_ns
+    if _example_chunks is None or _example_chunks[0] != (filepath, mtime):
+        chunks = ["".join(map(str, sublist)) for sublist in load_examples(filepath)]
+        _example_chunks = ((filepath, mtime), chunks)
+    return _example_chunks[1]
+
 
 def load_examples(filepath="run/examples.txt"):
     examples = []
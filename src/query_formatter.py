@@ -1,18 +1,33 @@
-import re
 from typing import List, Tuple
 
-QUERY_PATTERN = re.compile(r"\s*⟨(.*?)⟩\s*(.*?)\s*⟨(.*?)⟩\s*(\d+)\s*")
+from query_parser import Atom, Label, Node, Query, QuerySyntaxError, parse_label_regex, parse_path_regex, walk
 
-ROUTER_REGEX = re.compile(r"\[\.?#?(\w+)#?\.?\]")
+def routers_in(node: Node) -> List[str]:
+    """
+    Router names used in the atoms of a path regex. An interface written as
+    Router.interface counts as its router; "." and quoted names are skipped.
+    """
+    routers = []
+    for atom in walk(node):
+        if isinstance(atom, Atom):
+            for iface in (side for link in atom.links for side in link):
+                if iface != "." and not iface.startswith('"'):
+                    routers.append(iface)
+    return routers
+
+
+def _is_known_router(name: str, allowed_routers) -> bool:
+    return name in allowed_routers or name.split(".", 1)[0] in allowed_routers
 
 
-def validate_router_names(path: str, allowed_routers: List[str]) -> Tuple[bool, str]:
+def validate_router_names(path, allowed_routers: List[str]) -> Tuple[bool, str]:
     """
-    Extracts all router names from the path component and checks
-    whether they exist in the allowed router list.
+    Extracts all router names from the path component (a string or a parsed
+    path regex) and checks whether they exist in the allowed router list.
     """
-    used_routers = ROUTER_REGEX.findall(path)
-    invalid = [r for r in used_routers if r not in allowed_routers]
+    node = parse_path_regex(path) if isinstance(path, str) else path
+    allowed = set(allowed_routers)
+    invalid = list(dict.fromkeys(r for r in routers_in(node) if not _is_known_router(r, allowed)))
 
     if invalid:
         print(f"[!] Invalid router names in query: {', '.join(invalid)}")
@@ -20,77 +35,44 @@ def validate_router_names(path: str, allowed_routers: List[str]) -> Tuple[bool,
 
     return True, ""
 
+
+def invalid_labels(node: Node, model) -> List[str]:
+    label_set = set(model.labels)
+    return [label.name for label in walk(node) if isinstance(label, Label) and label.name not in label_set]
+
+
 def is_valid_label(label: str, model) -> bool:
     """
     Validates a label expression from <...>.
     Supports space-separated label stacks, comma-separated lists,
-    and regex-like modifiers (?, *, +) and wildcards.
+    label sets like [^800], groups, modifiers (?, *, +) and wildcards.
     """
-    label_set = set(model.labels)
-
-    # Split on spaces and commas, keep each part
-    parts = re.split(r'[,\s]+', label.strip())
-
-    for part in parts:
-        part = part.strip()
-        if not part:
-            continue
-
-        # Allow full wildcard expressions
-        if part in [".", ".*", ".+", ".?"]:
-            continue
-
-        # Allow label modifiers like *, +, ?
-        m = re.match(r'^(\w+)?$', part)
-        if m:
-            base_label = m.group(1)
-            if base_label not in label_set:
-                return False
-            continue
-
-        # Plain label
-        if part in label_set:
-            continue
-
-        return False  # invalid token
-
-    return True
+    try:
+        node = parse_label_regex(label.strip())
+    except QuerySyntaxError:
+        return False
+    return not invalid_labels(node, model)
 
 
 def is_valid_path_format(path: str, model) -> Tuple[bool, str]:
-    path = path.strip()
-    if not path:
-        return False, "Path is empty."
-
-    # 1. Character whitelist
-    allowed_chars_pattern = re.compile(r'^[\w\s\[\]\.\*\+\?\^\(\)\#\,\-\"]+$')
-    if not allowed_chars_pattern.fullmatch(path):
-        return False, "Path contains illegal characters."
-
-    # 2. Balanced brackets
-    if path.count('[') != path.count(']'):
-        return False, "Unbalanced square brackets."
-    if path.count('(') != path.count(')'):
-        return False, "Unbalanced parentheses."
-
-    # 3. Extract atom blocks
-    atom_pattern = re.compile(r'\[[^\[\]]+\]')
-    atoms = atom_pattern.findall(path)
-
-    for atom in atoms:
-        if not is_valid_atom_block(atom):
-            return False, f"Invalid atom block: {atom}"
-
-    # 4. Check router names inside atoms
-    is_valid, router_err = validate_router_names(path, model.routers)
-    if not is_valid:
-        return False, router_err
-
-    # 5. Check for forbidden leading ^ outside atoms
-    if re.search(r'\s\^', path) or path.lstrip().startswith('^'):
-        return False, "Invalid use of '^' outside of atoms."
+    try:
+        node = parse_path_regex(path.strip())
+    except QuerySyntaxError as e:
+        return False, str(e)
+    return validate_router_names(node, model.routers)
 
-    return True, ""
+
+def validate_query(query: Query, model) -> Tuple[bool, str]:
+    """
+    Checks the labels and routers of a parsed query against the network.
+    Returns (True, "") or (False, a message naming the offending part).
+    """
+    for part, node in (("start", query.start), ("end", query.end)):
+        unknown = invalid_labels(node, model)
+        if unknown:
+            print(f"[!] Invalid {part} label: <{query.source(part)}>")
+            return False, f"Invalid {part} label: <{query.source(part)}> uses unknown label(s) {', '.join(unknown)}"
+    return validate_router_names(query.path, model.routers)
 
 
 def is_valid_atom_block(atom: str) -> bool:
@@ -101,34 +83,7 @@ def is_valid_atom_block(atom: str) -> bool:
     - [^A#B], [A#B,C#D]
     - [^.#v1, .#v2], etc.
     """
-    atom = atom.strip()
-    if not atom.startswith('[') or not atom.endswith(']'):
-        return False
-
-    inner = atom[1:-1].strip()
-    if not inner:
+    try:
+        return isinstance(parse_path_regex(atom.strip()), Atom)
+    except QuerySyntaxError:
         return False
-
-    is_negated = inner.startswith('^')
-    if is_negated:
-        inner = inner[1:].strip()
-
-    parts = [p.strip() for p in inner.split(',') if p.strip()]
-    if not parts:
-        return False
-
-    for part in parts:
-        if '#' not in part:
-            return False
-
-        src, dst = part.split('#', 1)
-        for iface in (src, dst):
-            if iface == '.':
-                continue
-            if iface.startswith('"') and iface.endswith('"'):
-                continue
-            if not re.fullmatch(r'[\w\.]+', iface):
-                return False
-
-    return True
-
@@ -0,0 +1,423 @@
+import re
+from typing import Iterator, List, Tuple
+
+# AalWiNes query:  <label regex> path regex <label regex> k [mode]
+#
+# Both regexes share one grammar over different symbols:
+#   alternation := concat ("|" concat)*
+#   concat      := repeat*
+#   repeat      := primary ("*" | "+" | "?")*
+#   primary     := "." | "(" alternation ")" | symbol
+# In label regexes a symbol is a label name or a label set such as
+# [^800]; in path regexes it is an atom such as [.#R1] or [^A#B, .#C].
+# Parsing is a single left-to-right pass; every node keeps the span it
+# was parsed from, so errors can point at the exact characters.
+
+QUERY_MODES = ("DUAL", "OVER", "UNDER", "EXACT")
+
+# The query language uses ⟨⟩ in the papers and <> in the tool.
+_OPEN_BRACKETS = "<⟨"
+_CLOSE_BRACKETS = ">⟩"
+_REPEAT_OPS = "*+?"
+_NAME_PATTERN = re.compile(r"\w+")
+_IFACE_PATTERN = re.compile(r'"[^"]*"|[\w.]+')
+_INT_PATTERN = re.compile(r"\d+")
+_WORD_PATTERN = re.compile(r"[A-Za-z]+")
+
+Span = Tuple[int, int]
+
+
+class QuerySyntaxError(ValueError):
+    """
+    A query that does not follow the AalWiNes grammar. `span` is the
+    (start, end) character range of the offending part of `text`; `kind`
+    classifies errors that query_repair knows how to fix.
+    """
+
+    def __init__(self, message: str, text: str, span: Span, kind: str = "syntax"):
+        super().__init__(message)
+        self.message = message
+        self.text = text
+        self.span = span
+        self.kind = kind
+
+    def __str__(self):
+        start, end = self.span
+        fragment = self.text[start:end]
+        where = f" at '{fragment}'" if fragment else " at the end" if start >= len(self.text) else ""
+        return f"{self.message}{where} (characters {start}-{end})"
+
+    def pointer(self) -> str:
+        """
+        The query with the error span underlined on the next line.
+        """
+        start, end = self.span
+        return f"{self.text}\n{' ' * start}{'^' * max(1, end - start)}"
+
+
+class Node:
+    span: Span = (0, 0)
+
+
+class AnySymbol(Node):
+    def __init__(self, span: Span):
+        self.span = span
+
+
+class Label(Node):
+    def __init__(self, name: str, span: Span):
+        self.name = name
+        self.span = span
+
+
+class LabelSet(Node):
+    def __init__(self, negated: bool, items: List[Node], span: Span):
+        self.negated = negated
+        self.items = items
+        self.span = span
+
+
+class Atom(Node):
+    """
+    [src#dst, ...]: a link between interfaces; "." is any interface.
+    """
+
+    def __init__(self, negated: bool, links: List[Tuple[str, str]], span: Span):
+        self.negated = negated
+        self.links = links
+        self.span = span
+
+
+class Repeat(Node):
+    def __init__(self, node: Node, op: str, span: Span):
+        self.node = node
+        self.op = op
+        self.span = span
+
+
+class Concat(Node):
+    def __init__(self, items: List[Node], span: Span):
+        self.items = items
+        self.span = span
+
+
+class Alternation(Node):
+    def __init__(self, options: List[Node], span: Span):
+        self.options = options
+        self.span = span
+
+
+class Group(Node):
+    def __init__(self, node: Node, span: Span):
+        self.node = node
+        self.span = span
+
+
+def children(node: Node) -> List[Node]:
+    if isinstance(node, (Concat, LabelSet)):
+        return node.items
+    if isinstance(node, Alternation):
+        return node.options
+    if isinstance(node, (Repeat, Group)):
+        return [node.node]
+    return []
+
+
+def walk(node: Node) -> Iterator[Node]:
+    yield node
+    for child in children(node):
+        yield from walk(child)
+
+
+class Query:
+    """
+    A parsed query. `text` is the parsed string; start_label, path and
+    end_label give the source text of each part, with spans into `text`.
+    """
+
+    def __init__(self, text: str, start: Node, path: Node, end: Node, k: int, mode: str | None,
+                 spans: dict):
+        self.text = text
+        self.start = start
+        self.path = path
+        self.end = end
+        self.k = k
+        self.mode = mode
+        self.spans = spans
+
+    def source(self, part: str) -> str:
+        start, end = self.spans[part]
+        return self.text[start:end]
+
+    @property
+    def start_label(self) -> str:
+        return f"<{self.source('start')}>"
+
+    @property
+    def path_text(self) -> str:
+        return self.source("path").strip()
+
+    @property
+    def end_label(self) -> str:
+        return f"<{self.source('end')}>"
+
+    def atoms(self) -> List[Atom]:
+        return [node for node in walk(self.path) if isinstance(node, Atom)]
+
+    def labels(self) -> List[Label]:
+        return [node for root in (self.start, self.end) for node in walk(root) if isinstance(node, Label)]
+
+    def format(self, mode: str | None = None) -> str:
+        """
+        The query in canonical spacing, with `mode` (or its own) appended.
+        """
+        mode = mode or self.mode
+        text = f"{self.start_label} {self.path_text} {self.end_label} {self.k}"
+        return f"{text} {mode}" if mode else text
+
+    def __repr__(self):
+        return f"Query({self.format()!r})"
+
+
+class _Parser:
+    def __init__(self, text: str, labels: bool, end: int | None = None, pos: int = 0):
+        self.text = text
+        self.labels = labels
+        self.end = len(text) if end is None else end
+        self.pos = pos
+
+    def error(self, message: str, start: int, end: int | None = None, kind: str = "syntax"):
+        raise QuerySyntaxError(message, self.text, (start, start + 1 if end is None else end), kind)
+
+    def skip_space(self):
+        while self.pos < self.end and (self.text[self.pos].isspace() or (self.labels and self.text[self.pos] == ",")):
+            self.pos += 1
+
+    def peek(self) -> str:
+        self.skip_space()
+        return self.text[self.pos] if self.pos < self.end else ""
+
+    def parse(self) -> Node:
+        node = self.alternation()
+        if self.peek():
+            if self.peek() == ")":
+                self.error("Unbalanced parentheses: ')' without '('", self.pos, kind="unopened_paren")
+            self.error(f"Unexpected '{self.peek()}'", self.pos)
+        return node
+
+    def alternation(self) -> Node:
+        start = self.pos
+        options = [self.concat()]
+        while self.peek() == "|":
+            self.pos += 1
+            options.append(self.concat())
+        return options[0] if len(options) == 1 else Alternation(options, (start, self.pos))
+
+    def concat(self) -> Node:
+        self.skip_space()
+        start = self.pos
+        items = []
+        while self.peek() and self.peek() not in "|)":
+            items.append(self.repeat())
+        return items[0] if len(items) == 1 else Concat(items, (start, self.pos))
+
+    def repeat(self) -> Node:
+        node = self.primary()
+        while self.pos < self.end and self.text[self.pos] in _REPEAT_OPS:
+            self.pos += 1
+            node = Repeat(node, self.text[self.pos - 1], (node.span[0], self.pos))
+        return node
+
+    def primary(self) -> Node:
+        char = self.peek()
+        start = self.pos
+        if char == ".":
+            self.pos += 1
+            return AnySymbol((start, self.pos))
+        if char == "(":
+            self.pos += 1
+            node = self.alternation()
+            if self.peek() != ")":
+                self.error("Unbalanced parentheses: '(' is never closed", start, kind="unclosed_paren")
+            self.pos += 1
+            return Group(node, (start, self.pos))
+        if char == "[":
+            return self.label_set() if self.labels else self.atom()
+        if char in _REPEAT_OPS:
+            self.error(f"'{char}' must follow a symbol or group", start)
+        if char == "^":
+            self.error("'^' is only allowed at the start of a [...] block", start)
+        if char == "]":
+            self.error("Unbalanced square brackets: ']' without '['", start, kind="unopened_bracket")
+        if self.labels:
+            match = _NAME_PATTERN.match(self.text, self.pos, self.end)
+            if match:
+                self.pos = match.end()
+                return Label(match.group(), match.span())
+            self.error(f"Illegal character '{char}' in label", start)
+        match = _NAME_PATTERN.match(self.text, self.pos, self.end)
+        if match:
+            self.error(f"Router names must be written as atoms such as [.#{match.group()}]", start, match.end())
+        self.error(f"Illegal character '{char}' in path", start)
+
+    def _block_end(self, start: int) -> int:
+        close = self.text.find("]", start + 1, self.end)
+        nested = self.text.find("[", start + 1, self.end)
+        if close == -1:
+            self.error("Unbalanced square brackets: '[' is never closed", start, kind="unclosed_bracket")
+        if nested != -1 and nested < close:
+            self.error("Unbalanced square brackets: '[' is not closed before the next '['", start, nested,
+                       kind="unclosed_bracket")
+        return close
+
+    def label_set(self) -> Node:
+        start = self.pos
+        close = self._block_end(start)
+        inner = _Parser(self.text, labels=True, end=close, pos=start + 1)
+        negated = inner.peek() == "^"
+        if negated:
+            inner.pos += 1
+        items = []
+        while inner.peek():
+            items.append(inner.repeat())
+        self.pos = close + 1
+        return LabelSet(negated, items, (start, self.pos))
+
+    def atom(self) -> Node:
+        start = self.pos
+        close = self._block_end(start)
+        pos = start + 1
+        while pos < close and self.text[pos].isspace():
+            pos += 1
+        negated = pos < close and self.text[pos] == "^"
+        if negated:
+            pos += 1
+        links = []
+        for part_match in re.finditer(r"[^,]+", self.text[pos:close]):
+            part = part_match.group().strip()
+            part_start = pos + part_match.start()
+            if not part:
+                continue
+            if "#" not in part:
+                self.error(f"Atom part '{part}' needs the form source#target, e.g. [.#R1] or [R1#.]",
+                           part_start, pos + part_match.end())
+            source, target = (side.strip() for side in part.split("#", 1))
+            for iface in (source, target):
+                if not _IFACE_PATTERN.fullmatch(iface):
+                    self.error(f"Invalid interface '{iface}' in atom", part_start, pos + part_match.end())
+            links.append((source, target))
+        if not links:
+            self.error("Empty atom block", start, close + 1)
+        self.pos = close + 1
+        return Atom(negated, links, (start, self.pos))
+
+
+def parse_label_regex(text: str) -> Node:
+    """
+    Parses the contents of a label regex, without the surrounding <>.
+    """
+    return _Parser(text, labels=True).parse()
+
+
+def parse_path_regex(text: str) -> Node:
+    if not text.strip():
+        raise QuerySyntaxError("Path is empty", text, (0, len(text)))
+    return _Parser(text, labels=False).parse()
+
+
+def _label_part(text: str, pos: int, what: str) -> Tuple[Node, Span, int]:
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    if pos >= len(text) or text[pos] not in _OPEN_BRACKETS:
+        raise QuerySyntaxError(f"Expected the {what} label regex in <...>", text, (pos, pos + 1))
+    close = min((i for i in (text.find(c, pos + 1) for c in _CLOSE_BRACKETS) if i != -1), default=-1)
+    if close == -1:
+        raise QuerySyntaxError(f"The {what} label regex is never closed with '>'", text, (pos, len(text)),
+                               kind="unclosed_label")
+    node = _Parser(text, labels=True, end=close, pos=pos + 1).parse()
+    return node, (pos + 1, close), close + 1
+
+
+def parse_query(text: str) -> Query:
+    """
+    Parses a complete query such as "<.*> [.#R0] .* [R3#.] <.*> 1 DUAL".
+    Raises QuerySyntaxError with the span of the first problem.
+    """
+    start, start_span, pos = _label_part(text, 0, "start")
+
+    path_end = min((i for i in (text.find(c, pos) for c in _OPEN_BRACKETS) if i != -1), default=-1)
+    if path_end == -1:
+        raise QuerySyntaxError("Expected the end label regex in <...> after the path", text, (len(text), len(text)))
+    if not text[pos:path_end].strip():
+        raise QuerySyntaxError("Path is empty", text, (pos, path_end))
+    path = _Parser(text, labels=False, end=path_end, pos=pos).parse()
+    path_span = (pos, path_end)
+
+    end, end_span, pos = _label_part(text, path_end, "end")
+
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    k_match = _INT_PATTERN.match(text, pos)
+    if not k_match:
+        raise QuerySyntaxError("Expected the number of link failures after the end label", text, (pos, pos + 1),
+                               kind="missing_k")
+    pos = k_match.end()
+
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    mode = None
+    mode_match = _WORD_PATTERN.match(text, pos)
+    if mode_match:
+        if mode_match.group().upper() not in QUERY_MODES:
+            raise QuerySyntaxError(f"Unknown mode, expected one of {', '.join(QUERY_MODES)}", text, mode_match.span())
+        mode = mode_match.group().upper()
+        pos = mode_match.end()
+    if text[pos:].strip():
+        rest = pos + len(text[pos:]) - len(text[pos:].lstrip())
+        raise QuerySyntaxError("Unexpected text after the query", text, (rest, len(text.rstrip())))
+
+    spans = {"start": start_span, "path": path_span, "end": end_span, "k": k_match.span()}
+    return Query(text, start, path, end, int(k_match.group()), mode, spans)
+
+
+def find_query(text: str) -> Query:
+    """
+    Parses the query in a model answer: text before the first label regex
+    (e.g. "Query:") and code fences are ignored.
+    """
+    text = text.strip().strip("`").strip()
+    first = min((i for i in (text.find(c) for c in _OPEN_BRACKETS) if i != -1), default=0)
+    return parse_query(text[first:].strip())
+
+
+def to_pyformlang(node: Node) -> str:
+    """
+    Renders a label or path regex for pyformlang: any symbol becomes ANY,
+    atoms become alternatives of source_target symbols ("." as DOT), and
+    + and ? are expanded, since pyformlang only knows * and |.
+    """
+    if isinstance(node, AnySymbol):
+        return "(ANY)"
+    if isinstance(node, Label):
+        return node.name
+    if isinstance(node, (LabelSet, Atom)):
+        if isinstance(node, Atom):
+            symbols = [f"{src}_{dst}".replace(".", "DOT") for src, dst in node.links]
+        else:
+            symbols = [to_pyformlang(item) for item in node.items]
+        inner = "|".join(symbols)
+        return f"(~({inner}))" if node.negated else f"({inner})"
+    if isinstance(node, Group):
+        return f"({to_pyformlang(node.node)})"
+    if isinstance(node, Repeat):
+        inner = to_pyformlang(node.node)
+        if node.op == "*":
+            return f"({inner})*"
+        if node.op == "+":
+            return f"({inner}) ({inner})*"
+        return f"({inner}|$)"
+    if isinstance(node, Concat):
+        return " ".join(to_pyformlang(item) for item in node.items) if node.items else "$"
+    if isinstance(node, Alternation):
+        return "|".join(f"({to_pyformlang(option)})" for option in node.options)
+    raise TypeError(f"Unknown node {node!r}")
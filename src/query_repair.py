@@ -0,0 +1,170 @@
+import difflib
+import re
+from typing import List, Tuple
+
+from config import get_config_section
+from context_selector import match_routers
+from query_parser import Atom, Label, QuerySyntaxError, parse_query, walk
+
+REPAIR_DEFAULTS = {
+    "enabled": True,
+    "router_cutoff": 0.8
+}
+
+# At most this many syntax fixes per query; anything worse goes back to the LLM.
+MAX_SYNTAX_REPAIRS = 5
+
+_NUMBER_WORDS = {"no": 0, "zero": 0, "one": 1, "a": 1, "a single": 1, "two": 2, "three": 3, "four": 4, "five": 5}
+_FAILURES_PATTERN = re.compile(
+    r"\b(\d+|" + "|".join(sorted(_NUMBER_WORDS, key=len, reverse=True)) + r")\s+(?:link\s+)?failures?\b",
+    re.IGNORECASE
+)
+_TOKEN_END = re.compile(r"[\s<⟨]")
+_TRAILING_K = re.compile(r"\s+\d+(\s+[A-Za-z]+)?\s*$")
+
+
+def failures_from_description(description: str) -> int:
+    """
+    The number of link failures a description asks for ("at most one link
+    failure" -> 1), or 0, the default of the prompt rules.
+    """
+    match = _FAILURES_PATTERN.search(description or "")
+    if not match:
+        return 0
+    word = match.group(1).lower()
+    return int(word) if word.isdigit() else _NUMBER_WORDS[word]
+
+
+def _fix_syntax(error: QuerySyntaxError, description: str) -> Tuple[str, str] | None:
+    """
+    Applies the fix for one parse error and returns (text, note), or None
+    if the error is not one that can be fixed mechanically.
+    """
+    text = error.text
+    start = error.span[0]
+    if error.kind == "unclosed_bracket":
+        match = _TOKEN_END.search(text, start)
+        at = match.start() if match else len(text)
+        return text[:at] + "]" + text[at:], f"closed '[' at {start}"
+    if error.kind in ("unopened_bracket", "unopened_paren"):
+        return text[:start] + text[start + 1:], f"removed unmatched '{text[start]}' at {start}"
+    if error.kind == "unclosed_paren":
+        path_end = min((i for i in (text.find("<", start), text.find("⟨", start)) if i != -1), default=len(text))
+        head = text[:path_end].rstrip()
+        return f"{head}) {text[path_end:]}", f"closed '(' at {start}"
+    if error.kind == "unclosed_label":
+        trailing = _TRAILING_K.search(text, start)
+        at = trailing.start() if trailing else len(text.rstrip())
+        return text[:at] + ">" + text[at:], f"closed '<' at {start}"
+    if error.kind == "missing_k":
+        k = failures_from_description(description)
+        return f"{text[:start].rstrip()} {k}{text[start:]}", f"added missing k={k}"
+    return None
+
+
+def _close_match(name: str, choices: List[str], cutoff: float) -> str | None:
+    """
+    The only close match of name in choices: case-insensitive equality
+    first, then difflib similarity. Ties count as no match.
+    """
+    by_lower = {}
+    for choice in choices:
+        by_lower.setdefault(choice.lower(), []).append(choice)
+    if len(by_lower.get(name.lower(), [])) == 1:
+        return by_lower[name.lower()][0]
+    matches = difflib.get_close_matches(name, choices, n=2, cutoff=cutoff)
+    if len(matches) == 2:
+        ratio = lambda choice: difflib.SequenceMatcher(None, name, choice).ratio()
+        if ratio(matches[0]) == ratio(matches[1]):
+            return None
+    return matches[0] if matches else None
+
+
+def _canonical_label(label: str) -> str:
+    label = label.strip().strip("'\"").strip().lower()
+    return str(int(label)) if label.isdigit() else label
+
+
+def _repair_label(name: str, labels: List[str]) -> str | None:
+    """
+    The network label that name only spells differently: in case, quotes
+    or surrounding whitespace, or leading zeros of a number ("050510" ->
+    50510). Labels are never picked by similarity: 505100 and 50510 are
+    different MPLS labels, so an unknown label is left for the LLM retry.
+    """
+    matches = {label for label in labels if _canonical_label(label) == _canonical_label(name)}
+    return matches.pop() if len(matches) == 1 else None
+
+
+def _repair_router(name: str, routers: List[str], cutoff: float) -> str | None:
+    if name == "." or name.startswith('"') or name in routers:
+        return None
+    router, dot, interface = name.partition(".")
+    if dot and router in routers:
+        return None
+    hits = match_routers([router], routers, cutoff)
+    if len(hits) != 1:
+        hits = [hit for hit in [_close_match(router, routers, cutoff)] if hit]
+    return hits[0] + dot + interface if hits else None
+
+
+def _format_atom(atom: Atom, links) -> str:
+    return f"[{'^' if atom.negated else ''}{', '.join(f'{src}#{dst}' for src, dst in links)}]"
+
+
+def repair_query(query: str, model, description: str = "") -> Tuple[str | None, List[str]]:
+    """
+    Fixes near-valid queries without asking the LLM again: normalizes ⟨⟩
+    to <>, balances brackets and parentheses, adds a missing k (from the
+    description, else 0), replaces unknown router names by their unique
+    close match in the network and misspelled labels by the label they
+    spell (see _repair_label). Returns (repaired query, list
+    of repairs applied); the query is None if it still does not parse.
+    The result still has to pass check_query.
+    """
+    settings = get_config_section("query_repair", REPAIR_DEFAULTS)
+    repairs = []
+    text = (query or "").strip().strip("`").strip()
+    first = min((i for i in (text.find("<"), text.find("⟨")) if i != -1), default=0)
+    text = text[first:]
+    if "⟨" in text or "⟩" in text:
+        text = text.replace("⟨", "<").replace("⟩", ">")
+        repairs.append("normalized ⟨⟩ to <>")
+
+    for _ in range(MAX_SYNTAX_REPAIRS + 1):
+        try:
+            parsed = parse_query(text)
+            break
+        except QuerySyntaxError as e:
+            fixed = _fix_syntax(e, description)
+            if fixed is None:
+                return None, repairs
+            text, note = fixed
+            repairs.append(note)
+    else:
+        return None, repairs
+
+    edits = []
+    for atom in parsed.atoms():
+        links = []
+        for src, dst in atom.links:
+            new = [_repair_router(iface, model.routers, settings["router_cutoff"]) or iface for iface in (src, dst)]
+            for old, repaired in zip((src, dst), new):
+                if old != repaired:
+                    repairs.append(f"router {old} -> {repaired}")
+            links.append(tuple(new))
+        if links != atom.links:
+            edits.append((atom.span, _format_atom(atom, links)))
+
+    labels = [str(label) for label in model.labels if label is not None]
+    for root in (parsed.start, parsed.end):
+        for label in walk(root):
+            if isinstance(label, Label) and label.name not in labels:
+                repaired = _repair_label(label.name, labels)
+                if repaired:
+                    repairs.append(f"label {label.name} -> {repaired}")
+                    edits.append((label.span, repaired))
+
+    for (start, end), replacement in sorted(edits, reverse=True):
+        text = text[:start] + replacement + text[end:]
+    return text, repairs
@@ -1,76 +1,433 @@
-import json
-from tqdm import tqdm
+from __future__ import annotations
+
 import os
-import numpy as np
+import re
+import json
+import time
+import atexit
+import hashlib
 import pickle
-import faiss
-from typing import List, Dict, Any
-import sys
-from openai import OpenAI
-from dotenv import load_dotenv
-
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-
-if not api_key:
-    raise EnvironmentError("❌ OPENAI_API_KEY is not set or not found in .env")
-
-client = OpenAI(api_key=api_key)
+from typing import List, Dict, Any, Callable, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from filelock import FileLock
+from config import get_config_section
+from embedding_providers import EmbeddingProvider, get_embedding_provider
+from embedding_store import open_embedding_store
+from caching import LRUCache
+from file_utils import atomic_write
+from lazy_import import lazy_import
+from vector_index import INDEX_DEFAULTS, apply_search_params, build_vector_index, index_spec, reconstruct_vectors, supports_id_removal
+from query_repair import failures_from_description
 
-sys.stdout.reconfigure(encoding='utf-8')
-
-# OpenAI Client
-client = OpenAI()
+np = lazy_import("numpy")
+faiss = lazy_import("faiss")
 
 # --- EMBEDDINGS ---
-def load_embeddings_dict(path: str) -> Dict[str, List[float]]:
-    if not os.path.exists(path):
-        return {}
-    with open(path, "r") as f:
-        return json.load(f)
+# Embedding caches live in the binary store of embedding_store.py. These two
+# functions keep the old text->vector dictionary interface on top of it.
+def load_embeddings_dict(path: str) -> Dict[str, np.ndarray]:
+    store = open_embedding_store(path)
+    matrix = store.matrix()
+    return {text: matrix[row] for row, text in enumerate(store.texts())}
 
 def save_embeddings_dict(path: str, data: Dict[str, List[float]]):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w") as f:
-        json.dump(data, f)
+    store = open_embedding_store(path)
+    new = {text: vector for text, vector in data.items() if text not in store}
+    if new:
+        store.append(new.keys(), list(new.values()))
 
 def get_openai_embedding(text: str, model: str = "text-embedding-3-small") -> List[float]:
+    return get_openai_embeddings([text], model)[0]
+
+def get_openai_embeddings(texts: List[str], model: str = "text-embedding-3-small") -> List[List[float]]:
+    """
+    Embeds several texts with a single request. The result is in input order.
+    """
+    if not texts:
+        return []
+    try:
+        return get_embedding_provider(model).embed(texts).tolist()
+    except Exception as e:
+        print(f"[!] get_openai_embeddings() failed: {e}")
+        raise
+
+def embed_texts(texts: List[str], model: str | None = None) -> np.ndarray:
+    """
+    Embeds texts with the provider for `model` (None: the one configured in
+    config.json) and returns a float32 matrix, one row per text.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
     try:
-        response = client.embeddings.create(
-            model=model,
-            input=text
-        )
-        return response.data[0].embedding
+        return get_embedding_provider(model).embed(texts)
     except Exception as e:
-        print(f"[!] get_openai_embedding() failed: {e}")
+        print(f"[!] embed_texts() failed: {e}")
         raise
 
+def _cache_file_for(cache_file: str, provider: EmbeddingProvider) -> str:
+    # Vectors of different models must not share a cache. The unsuffixed
+    # file belongs to the original default model.
+    if provider.name == "text-embedding-3-small":
+        return cache_file
+    base, ext = os.path.splitext(cache_file)
+    return f"{base}.{provider.name}{ext}"
+
+
+QUERY_EMBEDDING_CACHE_DEFAULTS = {
+    "maxsize": 1024,
+    "ttl_seconds": None,
+    "persist_path": "results/query_embeddings.pkl",
+    "persist_every": 16
+}
+
+_query_embedding_cache: LRUCache | None = None
+_query_embedding_cache_lock = threading.Lock()
+_unsaved_query_embeddings = 0
+
+def _save_query_embedding_cache():
+    global _unsaved_query_embeddings
+    persist_path = get_config_section("query_embedding_cache", QUERY_EMBEDDING_CACHE_DEFAULTS)["persist_path"]
+    if _query_embedding_cache is not None and persist_path and _unsaved_query_embeddings:
+        try:
+            _query_embedding_cache.save(persist_path)
+            _unsaved_query_embeddings = 0
+        except OSError as e:
+            print(f"[!] Could not save query embedding cache: {e}")
+
+def get_query_embedding_cache() -> LRUCache:
+    """
+    Returns the process-wide LRU cache of query embeddings, configured by the
+    "query_embedding_cache" section of config.json. If persist_path is set,
+    the cache is loaded from there and written back periodically and at exit.
+    """
+    global _query_embedding_cache
+    with _query_embedding_cache_lock:
+        if _query_embedding_cache is None:
+            settings = get_config_section("query_embedding_cache", QUERY_EMBEDDING_CACHE_DEFAULTS)
+            cache = LRUCache(maxsize=settings["maxsize"], ttl=settings["ttl_seconds"])
+            if settings["persist_path"]:
+                cache.load(settings["persist_path"])
+                atexit.register(_save_query_embedding_cache)
+            _query_embedding_cache = cache
+        return _query_embedding_cache
+
+def query_embedding_cache_stats() -> Dict[str, Any]:
+    return get_query_embedding_cache().stats()
+
+def _normalize_query_text(text: str) -> str:
+    return " ".join(text.split())
+
+def get_query_embeddings(texts: List[str], model: str | None = None) -> List[np.ndarray]:
+    """
+    Embeds query texts through the query embedding cache, keyed on
+    (model, whitespace-normalized text). Only cache misses go to the API,
+    together in one request. Local providers are not cached.
+    """
+    global _unsaved_query_embeddings
+    provider = get_embedding_provider(model)
+    if not provider.cacheable:
+        return list(embed_texts(texts, provider.name))
+
+    cache = get_query_embedding_cache()
+    keys = [(provider.name, _normalize_query_text(text)) for text in texts]
+    vectors = [cache.get(key) for key in keys]
+
+    missing = list(dict.fromkeys(key for key, vector in zip(keys, vectors) if vector is None))
+    if missing:
+        fetched = embed_texts([text for _, text in missing], provider.name)
+        new = {key: np.asarray(embedding, dtype=np.float32) for key, embedding in zip(missing, fetched)}
+        for key, vector in new.items():
+            cache.put(key, vector)
+        vectors = [vector if vector is not None else new[key] for key, vector in zip(keys, vectors)]
+
+        _unsaved_query_embeddings += len(new)
+        settings = get_config_section("query_embedding_cache", QUERY_EMBEDDING_CACHE_DEFAULTS)
+        if _unsaved_query_embeddings >= settings["persist_every"]:
+            _save_query_embedding_cache()
 
-def embed_examples(chunks: List[str], cache_file: str = "embeddings/cache.json", model: str = "text-embedding-3-small") -> List[Dict]:
-    embedded = []
-    cache = load_embeddings_dict(cache_file)
-    updated = False
-    for chunk in tqdm(chunks, desc="Embedding chunks"):
-        if chunk in cache:
-            embedding = cache[chunk]
-        else:
-            embedding = get_openai_embedding(chunk, model)
-            cache[chunk] = embedding
-            updated = True
+    return vectors
 
-        embedded.append({"text": chunk, "embedding": embedding, "meta": chunk})
+EMBEDDING_DEFAULTS = {
+    "batch_size": 64,
+    "max_concurrency": 4
+}
 
-    if updated:
-        save_embeddings_dict(cache_file, cache)
+def embed_example_matrix(
+    chunks: List[str],
+    cache_file: str = "embeddings/cache.json",
+    model: str | None = None,
+    batch_size: int | None = None,
+    max_concurrency: int | None = None
+) -> np.ndarray:
+    """
+    Returns the embeddings of the chunks as a float32 matrix, one row per
+    chunk. Remote embeddings go through the cache: misses are sent to the
+    embeddings endpoint in batches, with up to max_concurrency batches in
+    flight. Batch size and concurrency default to the "embeddings" section
+    of config.json. Local providers embed the whole corpus in one call.
+    """
+    provider = get_embedding_provider(model)
+    if not provider.cacheable:
+        return embed_texts(chunks, provider.name)
 
-    return embedded
+    settings = get_config_section("embeddings", EMBEDDING_DEFAULTS)
+    batch_size = max(1, batch_size or settings["batch_size"])
+    max_concurrency = max(1, max_concurrency or settings["max_concurrency"])
+
+    store = open_embedding_store(_cache_file_for(cache_file, provider))
+    missing = list(dict.fromkeys(chunk for chunk in chunks if chunk not in store))
+
+    if missing:
+        from tqdm import tqdm
+
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as pool:
+            futures = {
+                pool.submit(embed_texts, batch, provider.name): batch
+                for batch in batches
+            }
+            # Each finished batch is appended right away, so a failing batch
+            # does not lose the others.
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Embedding batches"):
+                store.append(futures[future], future.result())
+
+    return store.matrix(chunks)
+
+def embed_examples(
+    chunks: List[str],
+    cache_file: str = "embeddings/cache.json",
+    model: str | None = None,
+    batch_size: int | None = None,
+    max_concurrency: int | None = None
+) -> List[Dict]:
+    vectors = embed_example_matrix(chunks, cache_file, model, batch_size, max_concurrency)
+    return [{"text": chunk, "embedding": vector, "meta": chunk} for chunk, vector in zip(chunks, vectors)]
 
 # --- FAISS ---
+EXAMPLE_INDEX_DIR = "results/example_index"
+
+EXAMPLE_INDEX_DEFAULTS = {
+    **INDEX_DEFAULTS,
+    "compact_tombstone_ratio": 0.5
+}
+
+def example_index_key(chunks: List[str], model: str, spec: str = "") -> str:
+    """
+    Version key of the example index: a hash over the embedding model name,
+    the index type spec and the example corpus. The index only has to be
+    rebuilt when it changes.
+    """
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(spec.encode("utf-8"))
+    for chunk in chunks:
+        digest.update(b"\0")
+        digest.update(chunk.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def example_id(chunk: str) -> int:
+    """
+    Stable FAISS id of an example: the first 60 bits of its sha256, so the
+    same example keeps its id across corpus edits and processes.
+    """
+    return int(hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:15], 16)
+
+def example_index_paths(key: str, index_dir: str = EXAMPLE_INDEX_DIR) -> Tuple[str, str]:
+    return os.path.join(index_dir, f"{key}.index"), os.path.join(index_dir, f"{key}.pkl")
+
+def read_current_index_key(index_dir: str = EXAMPLE_INDEX_DIR) -> str | None:
+    try:
+        with open(os.path.join(index_dir, "CURRENT"), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _write_current_index_key(key: str, index_dir: str = EXAMPLE_INDEX_DIR):
+    def write_key(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(key)
+
+    atomic_write(os.path.join(index_dir, "CURRENT"), write_key)
+
+# Index metadata is an ID-keyed store:
+#   {"format": "id-map", "model": str, "index_spec": str,
+#    "entries": {id: meta}, "tombstones": set of ids}
+# Tombstoned ids are still in the FAISS index but are skipped by searches
+# until the index is compacted.
+def _new_metadata(model: str | None = None, spec: str | None = None) -> Dict[str, Any]:
+    return {"format": "id-map", "model": model, "index_spec": spec, "entries": {}, "tombstones": set()}
+
+def _read_index_artifact(index_path: str, metadata_path: str):
+    index = faiss.read_index(index_path)
+    with open(metadata_path, "rb") as f:
+        metadata = pickle.load(f)
+    return index, metadata
+
+def _write_index_artifact(index, metadata: Dict[str, Any], index_path: str, metadata_path: str):
+    def write_metadata(tmp_path):
+        with open(tmp_path, "wb") as f:
+            pickle.dump(metadata, f)
+
+    # Metadata first: an index file on disk implies its metadata is complete.
+    atomic_write(metadata_path, write_metadata)
+    atomic_write(index_path, lambda tmp_path: faiss.write_index(index, tmp_path))
+
+def _is_id_map(metadata) -> bool:
+    return isinstance(metadata, dict) and metadata.get("format") == "id-map"
+
+def update_index_artifact(
+    index,
+    metadata: Dict[str, Any],
+    chunks: List[str],
+    vectors_for: Callable[[List[str]], np.ndarray],
+    settings: Dict[str, Any] | None = None
+):
+    """
+    Brings an ID-keyed index in line with `chunks` without rebuilding it:
+    new examples are embedded (via `vectors_for`) and added under their
+    stable ids, examples no longer in the corpus are tombstoned, and
+    tombstoned examples that come back are revived. Without an index, one
+    of the configured type is created and trained on the new vectors.
+    Returns (index, added, removed).
+    """
+    wanted = {example_id(chunk): chunk for chunk in chunks}
+    entries, tombstones = metadata["entries"], metadata["tombstones"]
+
+    new_ids = [i for i in wanted if i not in entries]
+    if new_ids:
+        vectors = np.ascontiguousarray(vectors_for([wanted[i] for i in new_ids]), dtype=np.float32)
+        if index is None:
+            index = build_vector_index(vectors, settings or EXAMPLE_INDEX_DEFAULTS, with_ids=True)
+        index.add_with_ids(vectors, np.array(new_ids, dtype=np.int64))
+        for i in new_ids:
+            entries[i] = wanted[i]
+
+    removed = [i for i in entries if i not in wanted and i not in tombstones]
+    tombstones.update(removed)
+    tombstones.difference_update(wanted)
+    return index, len(new_ids), len(removed)
+
+def compact_index_artifact(
+    index,
+    metadata: Dict[str, Any],
+    vectors_for: Callable[[List[str]], np.ndarray] | None = None,
+    settings: Dict[str, Any] | None = None
+):
+    """
+    Physically drops tombstoned examples from the index and the metadata.
+    Flat, SQ8 and PQ indexes remove them in place; IVF and HNSW indexes
+    are rebuilt from the live examples, embedded via `vectors_for` or
+    reconstructed from the index. Returns the compacted index.
+    """
+    dead = metadata["tombstones"]
+    if not dead:
+        return index
+    for i in dead:
+        metadata["entries"].pop(i, None)
+    metadata["tombstones"] = set()
+
+    if supports_id_removal(index):
+        index.remove_ids(np.array(sorted(dead), dtype=np.int64))
+        return index
+
+    live_ids = list(metadata["entries"])
+    if not live_ids:
+        index.reset()
+        return index
+    if vectors_for is not None:
+        vectors = vectors_for([metadata["entries"][i] for i in live_ids])
+    else:
+        vectors = reconstruct_vectors(index, live_ids)
+    rebuilt = build_vector_index(vectors, settings or EXAMPLE_INDEX_DEFAULTS, with_ids=True)
+    rebuilt.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.array(live_ids, dtype=np.int64))
+    return rebuilt
+
+def compact_example_index(index_dir: str = EXAMPLE_INDEX_DIR, cache_file: str = "embeddings/examples.json") -> int:
+    """
+    Compacts the current example index in place. Returns the number of
+    examples dropped.
+    """
+    with FileLock(os.path.join(index_dir, "build.lock")):
+        key = read_current_index_key(index_dir)
+        if key is None:
+            return 0
+        index_path, metadata_path = example_index_paths(key, index_dir)
+        index, metadata = _read_index_artifact(index_path, metadata_path)
+        dropped = len(metadata["tombstones"]) if _is_id_map(metadata) else 0
+        if dropped:
+            index = compact_index_artifact(
+                index, metadata,
+                lambda texts: embed_example_matrix(texts, cache_file=cache_file, model=metadata["model"]),
+                get_config_section("example_index", EXAMPLE_INDEX_DEFAULTS)
+            )
+            _write_index_artifact(index, metadata, index_path, metadata_path)
+            print(f"[i] Compacted example index {key}: dropped {dropped} removed examples")
+        return dropped
+
+_ensured_indexes: Dict[Tuple[str, str], Tuple[str, str]] = {}
+
+def ensure_example_index(
+    chunks: List[str],
+    cache_file: str = "embeddings/examples.json",
+    model: str | None = None,
+    index_dir: str = EXAMPLE_INDEX_DIR
+) -> Tuple[str, str]:
+    """
+    Returns (index_path, metadata_path) of the index for this example corpus.
+    Nothing is written if an artifact for the corpus/model key exists.
+    Otherwise the current artifact is updated incrementally (new examples
+    added, removed ones tombstoned) and saved under the new key; a full
+    build only happens without a usable previous artifact. Builders are
+    serialized by a file lock and all files are replaced atomically.
+    Raises ValueError for an empty corpus.
+    """
+    if not chunks:
+        raise ValueError("No example chunks to build the example index from.")
+    model = get_embedding_provider(model).name
+    settings = get_config_section("example_index", EXAMPLE_INDEX_DEFAULTS)
+    spec = index_spec(settings)
+    key = example_index_key(chunks, model, spec)
+    memo_key = (index_dir, key)
+    if memo_key in _ensured_indexes:
+        return _ensured_indexes[memo_key]
+
+    index_path, metadata_path = example_index_paths(key, index_dir)
+    os.makedirs(index_dir, exist_ok=True)
+    with FileLock(os.path.join(index_dir, "build.lock")):
+        if not (os.path.exists(index_path) and os.path.exists(metadata_path)):
+            index, metadata = None, _new_metadata(model, spec)
+            current = read_current_index_key(index_dir)
+            if current is not None:
+                try:
+                    previous = _read_index_artifact(*example_index_paths(current, index_dir))
+                    if _is_id_map(previous[1]) and previous[1]["model"] == model and previous[1].get("index_spec") == spec:
+                        index, metadata = previous
+                except (OSError, RuntimeError, pickle.UnpicklingError) as e:
+                    print(f"[!] Could not load example index {current}, rebuilding: {e}")
+
+            vectors_for = lambda texts: embed_example_matrix(texts, cache_file=cache_file, model=model)
+            index, added, removed = update_index_artifact(index, metadata, chunks, vectors_for, settings)
+            if metadata["tombstones"] and len(metadata["tombstones"]) > settings["compact_tombstone_ratio"] * index.ntotal:
+                index = compact_index_artifact(index, metadata, vectors_for, settings)
+            print(f"[i] Example index {key}: +{added} / -{removed} examples, {index.ntotal - len(metadata['tombstones'])} live")
+            _write_index_artifact(index, metadata, index_path, metadata_path)
+        if read_current_index_key(index_dir) != key:
+            _write_current_index_key(key, index_dir)
+
+    _ensured_indexes[memo_key] = (index_path, metadata_path)
+    return index_path, metadata_path
+
 def store_embeddings_in_faiss(
     embedded_chunks: List[Dict[str, Any]], 
     index_path: str = "results/faiss_index.index", 
-    metadata_path: str = "results/faiss_metadata.pkl"
+    metadata_path: str = "results/faiss_metadata.pkl",
+    vectors: np.ndarray | None = None
 ):
+    """
+    Builds an ID-keyed index from the chunks' embeddings, or from `vectors`
+    (one float32 row per chunk) if given, which avoids copying them into lists.
+    """
     if not embedded_chunks:
         raise ValueError("No embeddings provided to store in FAISS.")
     
@@ -78,35 +435,300 @@ def store_embeddings_in_faiss(
     os.makedirs(os.path.dirname(index_path), exist_ok=True)
 
 
-    first_vec = np.array(embedded_chunks[0]["embedding"], dtype=np.float32)
-    dim = first_vec.shape[0]
-    index = faiss.IndexFlatL2(dim)
+    if vectors is None:
+        vectors = np.vstack([np.asarray(entry["embedding"], dtype=np.float32) for entry in embedded_chunks])
 
-    embeddings = [np.array(entry["embedding"], dtype=np.float32) for entry in embedded_chunks]
-    metadata = [entry["meta"] for entry in embedded_chunks]
+    settings = get_config_section("example_index", EXAMPLE_INDEX_DEFAULTS)
+    index = build_vector_index(vectors, settings, with_ids=True)
+    metadata = _new_metadata(spec=index_spec(settings))
+    ids = [example_id(entry["text"]) for entry in embedded_chunks]
+    unique = {i: row for row, i in enumerate(ids)}
+    rows = sorted(unique.values())
+    index.add_with_ids(np.ascontiguousarray(vectors[rows], dtype=np.float32), np.array([ids[row] for row in rows], dtype=np.int64))
+    for row in rows:
+        metadata["entries"][ids[row]] = embedded_chunks[row]["meta"]
 
-    embeddings_np = np.vstack(embeddings)
-    index.add(embeddings_np)
+    _write_index_artifact(index, metadata, index_path, metadata_path)
 
-    faiss.write_index(index, index_path)
-    with open(metadata_path, "wb") as f:
-        pickle.dump(metadata, f)
 
+class ExampleRetriever:
+    """
+    Holds a FAISS index and its metadata in memory and searches against it.
+    The files are only read again when they change on disk, so a search
+    costs one query embedding plus the vector search itself.
+    """
 
-def search(query_text: str, model: str = "text-embedding-3-small", index_path: str = "results/faiss_index.index", metadata_path: str = "results/faiss_metadata.pkl", k: int = 5) -> List[Dict[str, Any]]:
-    try:
-        index = faiss.read_index(index_path)
-        with open(metadata_path, "rb") as f:
-            metadata = pickle.load(f)
+    def __init__(self, index_path: str, metadata_path: str, model: str | None = None):
+        self.index_path = index_path
+        self.metadata_path = metadata_path
+        self.model = model
+        self._lock = threading.Lock()
+        self._loaded = None  # (file stamp, index, metadata)
 
-        query_embedding = np.array([get_openai_embedding(query_text, model)], dtype=np.float32)
-        D, I = index.search(query_embedding, k)
-        return [metadata[i] for i in I[0] if 0 <= i < len(metadata)]
-    
+    def _file_stamp(self):
+        stamp = []
+        for path in (self.index_path, self.metadata_path):
+            st = os.stat(path)
+            stamp.extend((st.st_ino, st.st_size, st.st_mtime_ns))
+        return tuple(stamp)
+
+    def _snapshot(self):
+        stamp = self._file_stamp()
+        loaded = self._loaded
+        if loaded is not None and loaded[0] == stamp:
+            return loaded[1], loaded[2]
+
+        with self._lock:
+            if self._loaded is None or self._loaded[0] != stamp:
+                index = faiss.read_index(self.index_path)
+                apply_search_params(index, get_config_section("example_index", EXAMPLE_INDEX_DEFAULTS))
+                with open(self.metadata_path, "rb") as f:
+                    metadata = pickle.load(f)
+                self._loaded = (stamp, index, metadata)
+            return self._loaded[1], self._loaded[2]
+
+    def search(self, text: str, k: int = 5) -> List[Any]:
+        return self.search_many([text], k)[0]
+
+    def search_many(self, texts: List[str], k: int = 5) -> List[List[Any]]:
+        """
+        Searches several query texts at once: one embedding request and one
+        batched FAISS search for all of them.
+        """
+        if not texts:
+            return []
+        index, metadata = self._snapshot()
+        query_embeddings = np.vstack(get_query_embeddings(texts, self.model))
+        if not _is_id_map(metadata):
+            # Positional metadata list of indexes written before ids were used.
+            D, I = index.search(query_embeddings, k)
+            return [[metadata[i] for i in row if 0 <= i < len(metadata)] for row in I]
+
+        entries, tombstones = metadata["entries"], metadata["tombstones"]
+        fetch = min(index.ntotal, k + len(tombstones))
+        if fetch == 0:
+            return [[] for _ in texts]
+        D, I = index.search(query_embeddings, fetch)
+        return [[entries[i] for i in row if i in entries and i not in tombstones][:k] for row in I]
+
+_retrievers: Dict[Tuple[str, str, str], ExampleRetriever] = {}
+_retrievers_lock = threading.Lock()
+
+def get_retriever(index_path: str, metadata_path: str, model: str | None = None) -> ExampleRetriever:
+    """
+    Returns the process-wide retriever for these files, so all callers
+    (and all Streamlit sessions) share one in-memory copy of the index.
+    """
+    model = get_embedding_provider(model).name
+    key = (os.path.abspath(index_path), os.path.abspath(metadata_path), model)
+    with _retrievers_lock:
+        retriever = _retrievers.get(key)
+        if retriever is None:
+            retriever = ExampleRetriever(index_path, metadata_path, model)
+            _retrievers[key] = retriever
+        return retriever
+
+def search(query_text: str, model: str | None = None, index_path: str = "results/faiss_index.index", metadata_path: str = "results/faiss_metadata.pkl", k: int = 5) -> List[Dict[str, Any]]:
+    try:
+        return get_retriever(index_path, metadata_path, model).search(query_text, k)
     except Exception as e:
         print(f"[!] search() error: {e}")
         raise
 
+def search_many(query_texts: List[str], model: str | None = None, index_path: str = "results/faiss_index.index", metadata_path: str = "results/faiss_metadata.pkl", k: int = 5) -> List[List[Dict[str, Any]]]:
+    try:
+        return get_retriever(index_path, metadata_path, model).search_many(query_texts, k)
+    except Exception as e:
+        print(f"[!] search_many() error: {e}")
+        raise
+
+# --- SEMANTIC QUERY CACHE ---
+SEMANTIC_CACHE_DEFAULTS = {
+    "enabled": True,
+    "threshold": 0.92,
+    "dir": "results/query_cache",
+    "hit_log": "results/query_cache_hits.jsonl"
+}
+
+_WORD = re.compile(r"[\w.-]+")
+
+def description_signature(description: str, model) -> Tuple[int, Tuple[str, ...]]:
+    """
+    The parts of a description an embedding barely tells apart: the number
+    of link failures and the router names and labels it mentions, in order
+    of first appearance. Two descriptions only share a cached query if their
+    signatures are equal, however similar they are otherwise ("from R0 to
+    R3" vs "from R0 to R4", or reversed endpoints "from R3 to R0").
+    """
+    names = {str(name).lower() for name in list(model.routers) + list(model.labels) if name is not None}
+    words = (word.lower().strip(".") for word in _WORD.findall(description))
+    return failures_from_description(description), tuple(dict.fromkeys(word for word in words if word in names))
+
+def _unit_rows(vectors) -> np.ndarray:
+    # A normalized copy: the vectors may be a read-only memory map.
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+class SemanticQueryCache:
+    """
+    Validated queries of one network, keyed by the embedding of their
+    description. entries.jsonl holds one {"description", "query", "success"}
+    line per update, the latest line of a description wins; success is None
+    until AalWiNes has run the query. Description vectors are kept in the
+    embedding store next to it and searched by cosine similarity in an
+    in-memory flat index, which picks up lines appended by other processes.
+    """
+
+    def __init__(self, directory: str, model):
+        self.directory = directory
+        self.model = model
+        self.entries_path = os.path.join(directory, "entries.jsonl")
+        self.embedding_file = os.path.join(directory, "descriptions.json")
+        self._file_lock = FileLock(os.path.join(directory, "entries.lock"))
+        self._lock = threading.Lock()
+        self._offset = 0
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._descriptions: List[str] = []  # index row -> description
+        self._index = None
+
+    def _add_vectors(self, descriptions: List[str], vectors: np.ndarray):
+        vectors = _unit_rows(vectors)
+        if self._index is None:
+            self._index = faiss.IndexFlatIP(vectors.shape[1])
+        self._index.add(vectors)
+        self._descriptions.extend(descriptions)
+
+    def refresh(self):
+        """
+        Reads the lines appended since the last refresh and indexes the new
+        descriptions.
+        """
+        with self._lock:
+            if not os.path.exists(self.entries_path) or os.path.getsize(self.entries_path) <= self._offset:
+                return
+            new = []
+            with open(self.entries_path, "rb") as f:
+                f.seek(self._offset)
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        break  # line still being written
+                    self._offset += len(raw)
+                    entry = json.loads(raw)
+                    if entry["description"] not in self._entries and entry["description"] not in new:
+                        new.append(entry["description"])
+                    self._entries[entry["description"]] = entry
+            if new:
+                self._add_vectors(new, embed_example_matrix(new, cache_file=self.embedding_file))
+
+    def lookup(self, description: str, threshold: float, k: int = 5) -> Tuple[Dict[str, Any], float] | None:
+        """
+        The most similar stored entry at or above threshold whose query did
+        not fail in AalWiNes and whose description has the same signature,
+        as (entry, similarity); None if there is none.
+        """
+        self.refresh()
+        if self._index is None or self._index.ntotal == 0:
+            return None
+        vector = _unit_rows(get_query_embeddings([description])[0])
+        with self._lock:
+            D, I = self._index.search(vector, min(k, self._index.ntotal))
+            candidates = [(self._entries[self._descriptions[i]], float(d)) for d, i in zip(D[0], I[0]) if i >= 0]
+        signature = description_signature(description, self.model)
+        for entry, similarity in candidates:
+            if similarity < threshold:
+                break
+            if entry.get("success") is not False and description_signature(entry["description"], self.model) == signature:
+                return entry, similarity
+        return None
+
+    def add(self, description: str, query: str, success: bool | None = None):
+        """
+        Stores (or updates) the query for a description. The description's
+        vector comes from the query embedding cache, where the preceding
+        lookup left it.
+        """
+        provider = get_embedding_provider()
+        if provider.cacheable:
+            store = open_embedding_store(_cache_file_for(self.embedding_file, provider))
+            if description not in store:
+                store.append([description], get_query_embeddings([description]))
+        os.makedirs(self.directory, exist_ok=True)
+        line = json.dumps({"description": description, "query": query, "success": success}, ensure_ascii=False)
+        with self._file_lock:
+            with open(self.entries_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        self.refresh()
+
+_semantic_caches: Dict[str, SemanticQueryCache] = {}
+_semantic_caches_lock = threading.Lock()
+
+def get_semantic_cache(network_model) -> SemanticQueryCache | None:
+    """
+    Returns the process-wide semantic cache of a network, stored under
+    "<dir>/<network name>-<content hash>", so an edited network file starts
+    an empty cache. None if the cache is disabled or the model was not
+    loaded from a file.
+    """
+    settings = get_config_section("semantic_cache", SEMANTIC_CACHE_DEFAULTS)
+    if not settings["enabled"] or getattr(network_model, "fingerprint", None) is None:
+        return None
+    directory = os.path.join(settings["dir"], f"{network_model.name}-{network_model.fingerprint}")
+    with _semantic_caches_lock:
+        cache = _semantic_caches.get(directory)
+        if cache is None:
+            cache = SemanticQueryCache(directory, network_model)
+            _semantic_caches[directory] = cache
+        return cache
+
+def lookup_validated_query(description: str, network_model) -> str | None:
+    """
+    The validated query of a previous description of this network within
+    the configured similarity threshold, or None. Every hit is printed and
+    appended to the hit log.
+    """
+    cache = get_semantic_cache(network_model)
+    if cache is None:
+        return None
+    settings = get_config_section("semantic_cache", SEMANTIC_CACHE_DEFAULTS)
+    try:
+        hit = cache.lookup(description, settings["threshold"])
+    except Exception as e:
+        print(f"[!] Semantic cache lookup failed: {e}")
+        return None
+    if hit is None:
+        return None
+    entry, similarity = hit
+    print(f"[i] Semantic cache hit ({similarity:.3f}): \"{entry['description']}\" -> {entry['query']}")
+    if settings["hit_log"]:
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "network": network_model.name,
+            "description": description,
+            "matched_description": entry["description"],
+            "similarity": round(similarity, 4),
+            "query": entry["query"]
+        }
+        os.makedirs(os.path.dirname(settings["hit_log"]) or ".", exist_ok=True)
+        with FileLock(settings["hit_log"] + ".lock"):
+            with open(settings["hit_log"], "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return entry["query"]
+
+def record_validated_query(description: str, network_model, query: str, success: bool | None = None):
+    """
+    Stores a query that passed validation (success None) or its AalWiNes
+    outcome (True/False) for the description. Failed queries are never
+    served from the cache.
+    """
+    cache = get_semantic_cache(network_model)
+    if cache is None:
+        return
+    try:
+        cache.add(description, query, success)
+    except Exception as e:
+        print(f"[!] Could not store query in semantic cache: {e}")
+
 # --- EXAMPLES ---
 def load_examples2(filepath="run/examples.txt"):
     examples = []
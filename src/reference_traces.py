@@ -0,0 +1,157 @@
+"""
+Precomputes the core traces of the reference solutions in run/tasks.json.
+
+    python src/reference_traces.py
+    python src/reference_traces.py --tasks run/tasks.json --output results/reference_traces.json
+
+Every task's `solution` and `other_solutions` are run once (one AalWiNes
+invocation per network) and their extract_core_trace results are written
+to a JSON artifact. The artifact records the hashes of the task file, the
+weight file, every network file and the AalWiNes binary and flags it was
+built from; verify_trace only uses entries whose hashes still match and
+falls back to running the reference query otherwise.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from typing import Any, Dict, List, Tuple
+
+from aalwines_runner import AALWINES_FLAGS, file_hash, get_aalwines_bin, get_aalwines_pool, normalize_query
+from config import get_config_section
+from file_utils import atomic_write
+
+REFERENCE_TRACES_DEFAULTS = {
+    "path": "results/reference_traces.json",
+    "tasks_path": "run/tasks.json",
+    "weight_path": "run/Agis-weight.json",
+    "network_dir": "networks"
+}
+
+# verify_trace runs queries in this mode; the artifact is keyed the same way.
+QUERY_MODE = "DUAL"
+
+
+def task_queries(task: Dict[str, Any]) -> List[str]:
+    """
+    The reference queries of a task: its solution and all other solutions.
+    """
+    queries = [task["solution"]]
+    for group in task.get("other_solutions", []):
+        queries.extend([group] if isinstance(group, str) else group)
+    return [f"{query.strip()} {QUERY_MODE}" for query in queries]
+
+
+def build_reference_traces(tasks_path: str, weight_path: str, network_dir: str, output_path: str) -> Dict[str, Any]:
+    """
+    Runs all reference queries and writes the artifact. Returns it.
+    """
+    from student_query_checker import extract_core_trace
+
+    with open(tasks_path, "r", encoding="utf-8") as f:
+        tasks = json.load(f)
+    by_network: Dict[str, List[str]] = {}
+    for task in tasks:
+        queries = by_network.setdefault(task["model"], [])
+        queries.extend(query for query in task_queries(task) if query not in queries)
+
+    pool = get_aalwines_pool()
+    futures = {
+        network: pool.submit_batch(queries, os.path.join(network_dir, network), weight_path)
+        for network, queries in by_network.items()
+    }
+    networks = {}
+    for network, future in futures.items():
+        traces = {}
+        for query, (success, output) in zip(by_network[network], future.result()):
+            trace = extract_core_trace(output) if success else None
+            traces[normalize_query(query)] = {"success": success, "trace": trace}
+            if trace is None:
+                print(f"[!] No trace for reference query on {network}: {query}")
+        networks[network] = {"hash": file_hash(os.path.join(network_dir, network)), "traces": traces}
+
+    artifact = {
+        "tasks_path": tasks_path,
+        "tasks_hash": file_hash(tasks_path),
+        "weight_hash": file_hash(weight_path),
+        "aalwines": f"{get_aalwines_bin()} {AALWINES_FLAGS}",
+        "networks": networks
+    }
+
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(artifact, f, ensure_ascii=False, indent=1)
+
+    atomic_write(output_path, write)
+    return artifact
+
+
+_loaded: Tuple[Tuple[int, int, int], Dict[str, Any]] | None = None
+_loaded_lock = threading.Lock()
+
+
+def load_reference_traces() -> Dict[str, Any] | None:
+    """
+    The artifact configured in the "reference_traces" section of
+    config.json, re-read only when the file changes. None if it is missing
+    or was built from another task file or AalWiNes build.
+    """
+    global _loaded
+    settings = get_config_section("reference_traces", REFERENCE_TRACES_DEFAULTS)
+    try:
+        st = os.stat(settings["path"])
+    except FileNotFoundError:
+        return None
+    stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+    with _loaded_lock:
+        if _loaded is None or _loaded[0] != stamp:
+            with open(settings["path"], "r", encoding="utf-8") as f:
+                _loaded = (stamp, json.load(f))
+        artifact = _loaded[1]
+    try:
+        current = (file_hash(artifact["tasks_path"]), f"{get_aalwines_bin()} {AALWINES_FLAGS}")
+    except OSError:
+        return None
+    if current != (artifact["tasks_hash"], artifact["aalwines"]):
+        return None
+    return artifact
+
+
+def reference_trace(query: str, model_path: str, weight_path: str) -> Dict[str, Any] | None:
+    """
+    The precomputed {"success", "trace"} of a reference query on a network,
+    or None if the artifact has no current entry for it (stale network or
+    weight file, unknown query).
+    """
+    artifact = load_reference_traces()
+    if artifact is None:
+        return None
+    network = artifact["networks"].get(os.path.basename(model_path))
+    try:
+        if network is None or network["hash"] != file_hash(model_path) or artifact["weight_hash"] != file_hash(weight_path):
+            return None
+    except OSError:
+        return None
+    return network["traces"].get(normalize_query(query))
+
+
+def main():
+    settings = get_config_section("reference_traces", REFERENCE_TRACES_DEFAULTS)
+    parser = argparse.ArgumentParser(description="Precompute reference traces of the task set.")
+    parser.add_argument("--tasks", default=settings["tasks_path"])
+    parser.add_argument("--weights", default=settings["weight_path"])
+    parser.add_argument("--networks", default=settings["network_dir"])
+    parser.add_argument("--output", default=settings["path"])
+    args = parser.parse_args()
+
+    sys.stdout.reconfigure(encoding='utf-8')
+    artifact = build_reference_traces(args.tasks, args.weights, args.networks, args.output)
+    entries = [entry for network in artifact["networks"].values() for entry in network["traces"].values()]
+    missing = sum(1 for entry in entries if entry["trace"] is None)
+    print(f"[✓] {len(entries)} reference traces for {len(artifact['networks'])} networks written to {args.output}"
+          + (f" ({missing} without trace)" if missing else ""))
+
+
+if __name__ == "__main__":
+    main()
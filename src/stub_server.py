@@ -0,0 +1,327 @@
+"""
+Local stand-in for the OpenAI chat completions and embeddings endpoints.
+
+    python src/stub_server.py                     # synthetic answers
+    python src/stub_server.py --mode record       # forward to OpenAI, save fixtures
+    python src/stub_server.py --mode replay --latency-ms 300 --jitter-ms 100
+
+Point the pipeline at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1 (or
+"base_url" in the "llm_backend" section of config.json); no API key is
+needed except for recording.
+
+Modes:
+  stub    deterministic answers without any network access: a query over
+          the first and last router of the prompt's network segment,
+          a fixed chat answer and hashed n-gram embeddings
+  record  forwards every request to the upstream API and appends the
+          response to the fixture file
+  replay  answers from the fixture file only; unknown requests get a 404
+
+Fixtures are keyed on the request body without its streaming options, so a
+streamed request replays a recorded plain one. Streaming is simulated from
+the complete answer, chunk by chunk. Latency is injected before every
+answer (latency_ms plus up to jitter_ms) and between streamed chunks
+(token_latency_ms). Defaults come from llm_backend.stub in config.json.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+from config import get_config_section
+from llm_client import LLM_BACKEND_DEFAULTS
+
+STUB_MODES = ("stub", "record", "replay")
+
+STUB_CHAT_ANSWER = "This is a stub answer from the local LLM server."
+
+# Options that change how an answer is delivered, not what it is.
+_DELIVERY_FIELDS = ("stream", "stream_options")
+
+
+def request_key(endpoint: str, body: Dict[str, Any]) -> str:
+    request = {name: value for name, value in body.items() if name not in _DELIVERY_FIELDS}
+    payload = json.dumps({"endpoint": endpoint, "request": request}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class FixtureStore:
+    """
+    Recorded responses in a JSONL file, one {"key", "endpoint", "request",
+    "response"} object per line. Loaded once, appended to while recording.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._responses: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._responses[entry["key"]] = entry["response"]
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        return self._responses.get(key)
+
+    def add(self, key: str, endpoint: str, request: Dict[str, Any], response: Dict[str, Any]):
+        with self._lock:
+            self._responses[key] = response
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8", newline="\n") as f:
+                f.write(json.dumps({"key": key, "endpoint": endpoint, "request": request, "response": response},
+                                   ensure_ascii=False) + "\n")
+
+
+def _count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def stub_query(messages) -> str:
+    """
+    A syntactically valid query over the routers listed in the prompt, so
+    generated queries pass validation.
+    """
+    text = "\n".join(message.get("content") or "" for message in messages)
+    match = re.search(r"^Network routers: (.*)$", text, re.MULTILINE)
+    routers = [name.strip() for name in match.group(1).split(",")] if match else []
+    routers = [name for name in routers if re.fullmatch(r"\w+", name)]
+    if not routers:
+        return "<.*> .* <.*> 0"
+    return f"<.*> [.#{routers[0]}] .* [{routers[-1]}#.] <.*> 0"
+
+
+def stub_chat_completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    messages = body.get("messages", [])
+    is_query = any("AalWiNes query" in (message.get("content") or "") for message in messages
+                   if message.get("role") == "system")
+    content = stub_query(messages) if is_query else STUB_CHAT_ANSWER
+    prompt_tokens = sum(_count_tokens(message.get("content") or "") for message in messages)
+    completion_tokens = _count_tokens(content)
+    return {
+        "id": f"chatcmpl-stub-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+            for i in range(body.get("n") or 1)
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0}
+        }
+    }
+
+
+def stub_embeddings(body: Dict[str, Any], dim: int) -> Dict[str, Any]:
+    from embedding_providers import HashedNgramEmbeddingProvider
+
+    texts = body.get("input", [])
+    texts = [texts] if isinstance(texts, str) else list(texts)
+    vectors = HashedNgramEmbeddingProvider(body.get("dimensions") or dim).embed(texts)
+    tokens = sum(_count_tokens(text) for text in texts)
+    return {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": vector.tolist()} for i, vector in enumerate(vectors)],
+        "model": body.get("model", "stub"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    }
+
+
+def stream_chunks(response: Dict[str, Any], include_usage: bool):
+    """
+    Splits a chat completion into chat.completion.chunk objects, a few
+    words per chunk, the way the API streams it.
+    """
+    base = {"id": response["id"], "object": "chat.completion.chunk",
+            "created": response["created"], "model": response["model"]}
+    for choice in response["choices"]:
+        index = choice["index"]
+        yield {**base, "choices": [{"index": index, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+        for part in re.findall(r"\s*\S+", choice["message"].get("content") or ""):
+            yield {**base, "choices": [{"index": index, "delta": {"content": part}, "finish_reason": None}]}
+        yield {**base, "choices": [{"index": index, "delta": {}, "finish_reason": choice.get("finish_reason", "stop")}]}
+    if include_usage:
+        yield {**base, "choices": [], "usage": response.get("usage")}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, settings: Dict[str, Any]):
+        super().__init__(address, StubRequestHandler)
+        self.settings = settings
+        self.fixtures = FixtureStore(settings["fixtures"]) if settings["mode"] in ("record", "replay") else None
+
+    def inject_latency(self):
+        delay_ms = self.settings["latency_ms"] + random.uniform(0, self.settings["jitter_ms"])
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def upstream(self, endpoint: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise EnvironmentError("OPENAI_API_KEY is needed to record from the upstream API.")
+        request = urllib.request.Request(
+            f"{self.settings['upstream'].rstrip('/')}/{endpoint}",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return json.loads(response.read())
+
+    def respond(self, endpoint: str, body: Dict[str, Any]) -> Dict[str, Any] | None:
+        """
+        The complete (non-streamed) response to a request, or None if a
+        replay has no fixture for it.
+        """
+        mode = self.settings["mode"]
+        if mode == "stub":
+            if endpoint == "embeddings":
+                return stub_embeddings(body, self.settings["embedding_dim"])
+            return stub_chat_completion(body)
+
+        key = request_key(endpoint, body)
+        response = self.fixtures.get(key)
+        if response is None and mode == "record":
+            request = {name: value for name, value in body.items() if name not in _DELIVERY_FIELDS}
+            response = self.upstream(endpoint, request)
+            self.fixtures.add(key, endpoint, request, response)
+        return response
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    server: StubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str):
+        self._send_json(status, {"error": {"message": message, "type": "stub_error", "code": status}})
+
+    def _send_stream(self, response: Dict[str, Any], include_usage: bool):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        token_latency = self.server.settings["token_latency_ms"] / 1000
+        for chunk in stream_chunks(response, include_usage):
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if token_latency > 0:
+                time.sleep(token_latency)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            endpoint = "chat/completions"
+        elif path.endswith("/embeddings"):
+            endpoint = "embeddings"
+        else:
+            self._send_error(404, f"Unknown endpoint {self.path}")
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except json.JSONDecodeError as e:
+            self._send_error(400, f"Invalid JSON body: {e}")
+            return
+
+        self.server.inject_latency()
+        try:
+            response = self.server.respond(endpoint, body)
+        except urllib.error.HTTPError as e:
+            self._send_error(e.code, f"Upstream error: {e.read().decode('utf-8', 'replace')}")
+            return
+        except Exception as e:
+            self._send_error(500, f"{type(e).__name__}: {e}")
+            return
+        if response is None:
+            self._send_error(404, f"No recorded response for this {endpoint} request.")
+            return
+
+        if body.get("stream") and endpoint == "chat/completions":
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            self._send_stream(response, include_usage)
+        else:
+            self._send_json(200, response)
+
+
+def stub_settings(**overrides) -> Dict[str, Any]:
+    settings = get_config_section("llm_backend", LLM_BACKEND_DEFAULTS)
+    stub = {**LLM_BACKEND_DEFAULTS["stub"], **(settings.get("stub") or {})}
+    stub.update({name: value for name, value in overrides.items() if value is not None})
+    if stub["mode"] not in STUB_MODES:
+        raise ValueError(f"Unknown stub mode '{stub['mode']}', expected one of {', '.join(STUB_MODES)}.")
+    return stub
+
+
+def start_stub_server(**overrides) -> StubServer:
+    """
+    Starts the server on a background thread and returns it; call
+    shutdown() to stop. port=0 picks a free port (see server_address).
+    """
+    settings = stub_settings(**overrides)
+    server = StubServer((settings["host"], settings["port"]), settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible local stub server with record/replay.")
+    parser.add_argument("--mode", choices=STUB_MODES)
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--fixtures", help="JSONL fixture file for record/replay")
+    parser.add_argument("--upstream", help="API base URL to record from")
+    parser.add_argument("--latency-ms", type=float, help="delay before every response")
+    parser.add_argument("--jitter-ms", type=float, help="random extra delay, uniform in [0, jitter]")
+    parser.add_argument("--token-latency-ms", type=float, help="delay between streamed chunks")
+    args = parser.parse_args()
+
+    settings = stub_settings(
+        mode=args.mode, host=args.host, port=args.port, fixtures=args.fixtures, upstream=args.upstream,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, token_latency_ms=args.token_latency_ms
+    )
+    server = StubServer((settings["host"], settings["port"]), settings)
+    host, port = server.server_address[:2]
+    fixtures = f", {len(server.fixtures)} fixture(s) in {settings['fixtures']}" if server.fixtures is not None else ""
+    print(f"[i] Stub LLM server in {settings['mode']} mode on http://{host}:{port}/v1{fixtures}")
+    print(f"[i] Use it with OPENAI_BASE_URL=http://{host}:{port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[i] Stopped.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,17 @@
 import json
-from main import run_aalwines
-from pyformlang.regular_expression import Regex
-from prompt_builder import extract_parts
-import re
+from aalwines_runner import get_aalwines_pool
+from reference_traces import reference_trace
+from query_parser import QuerySyntaxError, find_query, parse_label_regex, parse_path_regex, to_pyformlang
 
-def extract_core_trace(output_str):
+def extract_core_trace(output_str, query_id="Q1"):
     """
-    Extract simplified core trace from the AalWiNes output JSON string.
+    Extract simplified core trace of answer `query_id` ("Q1", "Q2", ... for
+    the queries of a file) from the AalWiNes output JSON string.
     Assumes 'trace' is part of the output and returns key features for comparison.
     """
     try:
         result = json.loads(output_str)
-        trace = result.get("answers", {}).get("Q1", {}).get("trace", [])
+        trace = result.get("answers", {}).get(query_id, {}).get("trace", [])
         if not trace:
             return None
 
@@ -32,9 +32,29 @@ def extract_core_trace(output_str):
     except Exception:
         return None
     
-def verify_trace(student_query, reference_query, model_path, weight_path, query_path):
-    success_s, result_s = run_aalwines(student_query, model_path, weight_path, query_path)
-    success_r, result_r = run_aalwines(reference_query, model_path, weight_path, query_path)
+def verify_trace(student_query, reference_query, model_path, weight_path, query_path=None):
+    """
+    Compares the core traces of the student and the reference query. The
+    reference trace comes from the precomputed artifact (see
+    reference_traces.py) if it is current, and only the student query is
+    run; result_r is None then. Otherwise both queries are run in one
+    AalWiNes invocation. query_path is no longer used: every run writes its
+    own temporary query file.
+    """
+    precomputed = reference_trace(reference_query, model_path, weight_path)
+    if precomputed is not None:
+        success_s, result_s = get_aalwines_pool().submit(student_query, model_path, weight_path).result()
+        core_r = precomputed["trace"]
+        if not (success_s and precomputed["success"]):
+            return False, result_s, None
+        core_s = extract_core_trace(result_s)
+        print(f"Core S: {core_s}")
+        print(f"Core R (precomputed): {core_r}")
+        return bool(core_s and core_r) and core_s == core_r, result_s, None
+
+    (success_s, result_s), (success_r, result_r) = get_aalwines_pool().submit_batch(
+        [student_query, reference_query], model_path, weight_path
+    ).result()
     
     if not (success_s and success_r):
         return False, result_s, result_r
@@ -72,30 +92,29 @@ def is_structurally_valid(student_query: str, task: dict) -> bool:
     return True
 
 def are_queries_equivalent(query1: str, query2: str) -> bool:
+    try:
+        parsed1 = find_query(query1)
+        parsed2 = find_query(query2)
+    except QuerySyntaxError as e:
+        print(f"Error when parsing '{e.text}': {e}")
+        return False
 
-    start1, path1, end1, k1 = extract_parts(query1)
-    start2, path2, end2, k2 = extract_parts(query2)
-
-    if k1 != k2:
+    if parsed1.k != parsed2.k:
         return False
 
-    def to_nfa(regex_str):
+    from pyformlang.regular_expression import Regex
+
+    def to_nfa(node):
         try:
-            normalized = normalize_aalwines_regex(regex_str)
-            return Regex(normalized).to_epsilon_nfa()
+            return Regex(to_pyformlang(node)).to_epsilon_nfa()
         except Exception as e:
-            print(f"Error when parsing '{regex_str}': {e}")
+            print(f"Error when converting '{to_pyformlang(node)}': {e}")
             return None
 
-    start_nfa1 = to_nfa(start1)
-    start_nfa2 = to_nfa(start2)
-    path_nfa1 = to_nfa(path1)
-    path_nfa2 = to_nfa(path2)
-    end_nfa1 = to_nfa(end1)
-    end_nfa2 = to_nfa(end2)
-
-    if any(x is None for x in [start_nfa1, start_nfa2, path_nfa1, path_nfa2, end_nfa1, end_nfa2]):
+    nfas = [to_nfa(node) for node in (parsed1.start, parsed2.start, parsed1.path, parsed2.path, parsed1.end, parsed2.end)]
+    if any(x is None for x in nfas):
         return False
+    start_nfa1, start_nfa2, path_nfa1, path_nfa2, end_nfa1, end_nfa2 = nfas
 
     return (
         start_nfa1.is_equivalent_to(start_nfa2)
@@ -105,29 +124,10 @@ def are_queries_equivalent(query1: str, query2: str) -> bool:
 
 
 def normalize_aalwines_regex(expr: str) -> str:
+    """
+    Renders a label regex (with its <>) or a path regex in pyformlang syntax.
+    """
     expr = expr.strip()
-    #expr = re.sub(r"[()]", "", expr)
-    expr = re.sub(r"\.\+", "(ANY)(ANY)*", expr)
-    expr = re.sub(r"\.\*", "(ANY)*", expr)
-    expr = re.sub(r"\.", "(ANY)", expr)
-    expr = re.sub(r"(?<!\()(?<!ANY)\.(?!\*|\+)", "ANY", expr)
-    expr = re.sub(r"(?<!\w)(\w+)\+", r"\1 \1*", expr)
-    expr = re.sub(r"\(([^()]+)\)\+", r"(\1) (\1)*", expr)
-    
-
-    def transform_atom_list(match):
-        raw = match.group(0)
-        content = match.group(1).strip()
-        negated = raw.startswith("[^")
-        parts = [c.strip() for c in content.split(",")]
-        transformed = []
-        for part in parts:
-            part = part.replace("#", "_").replace(".", "DOT")
-            transformed.append(part)
-        inner = "|".join(transformed)
-        return f"(~({inner}))" if negated else f"({inner})"
-
-    expr = re.sub(r"\[\^([^\]]+)\]", transform_atom_list, expr)
-    expr = re.sub(r"\[([^\]]+)\]", transform_atom_list, expr)
-
-    return expr
\ No newline at end of file
+    if expr[:1] in "<⟨" and expr[-1:] in ">⟩":
+        return to_pyformlang(parse_label_regex(expr[1:-1]))
+    return to_pyformlang(parse_path_regex(expr))
@@ -0,0 +1,55 @@
+import threading
+from typing import Any, Dict
+
+TOKEN_FIELDS = ("requests", "prompt_tokens", "cached_tokens", "completion_tokens")
+
+
+def usage_counts(usage) -> Dict[str, int]:
+    """
+    Token counts of an OpenAI `usage` object. cached_tokens is the part of
+    the prompt served from the provider's prefix cache.
+    """
+    if usage is None:
+        return {"requests": 1, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "requests": 1,
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+
+
+def add_counts(total: Dict[str, int], counts: Dict[str, int]):
+    for field in TOKEN_FIELDS:
+        total[field] = total.get(field, 0) + counts.get(field, 0)
+
+
+class TokenUsage:
+    """
+    Thread-safe token counters per endpoint ("query", "answer", ...) for
+    the lifetime of the process.
+    """
+
+    def __init__(self):
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, usage, into: Dict[str, int] | None = None) -> Dict[str, int]:
+        """
+        Adds the counts of `usage` to the endpoint totals and, if given, to
+        the caller's own counter dict `into`. Returns the counts.
+        """
+        counts = usage_counts(usage)
+        with self._lock:
+            add_counts(self._totals.setdefault(endpoint, {}), counts)
+            if into is not None:
+                add_counts(into, counts)
+        return counts
+
+    def totals(self) -> Dict[str, Any]:
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._totals.items()}
+
+
+token_usage = TokenUsage()
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Dict
+
+from lazy_import import lazy_import
+
+faiss = lazy_import("faiss")
+np = lazy_import("numpy")
+
+# Index types for the example index, selected by "example_index.type" in
+# config.json. Build parameters are clamped to what the corpus can train.
+INDEX_DEFAULTS = {
+    "type": "flat",
+    "ivf": {"nlist": 256, "nprobe": 16},
+    "hnsw": {"m": 32, "ef_construction": 80, "ef_search": 64},
+    "pq": {"m": 16, "nbits": 8},
+}
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "pq", "sq8")
+
+
+def _section(settings: Dict[str, Any], name: str) -> Dict[str, Any]:
+    return {**INDEX_DEFAULTS[name], **(settings.get(name) or {})}
+
+
+def index_factory_string(settings: Dict[str, Any], n: int, dim: int) -> str:
+    """
+    Returns the faiss.index_factory description for the configured index
+    type and a training set of n vectors of dimension dim.
+    """
+    index_type = settings.get("type", "flat")
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf":
+        # faiss wants about 39 training points per list.
+        nlist = max(1, min(_section(settings, "ivf")["nlist"], n // 39))
+        return f"IVF{nlist},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{_section(settings, 'hnsw')['m']},Flat"
+    if index_type == "pq":
+        pq = _section(settings, "pq")
+        m = max(d for d in range(1, min(pq["m"], dim) + 1) if dim % d == 0)
+        nbits = max(1, min(pq["nbits"], int(math.log2(max(n, 2)))))
+        return f"PQ{m}x{nbits}"
+    if index_type == "sq8":
+        return "SQ8"
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {', '.join(INDEX_TYPES)}.")
+
+
+def index_spec(settings: Dict[str, Any]) -> str:
+    """
+    Identifies the configured index type and its build parameters, for
+    artifact keys. Query-time parameters are left out: changing them does
+    not need a rebuild.
+    """
+    index_type = settings.get("type", "flat")
+    params = _section(settings, index_type) if index_type in ("ivf", "hnsw", "pq") else {}
+    build_params = sorted((name, value) for name, value in params.items() if name not in ("nprobe", "ef_search"))
+    return f"{index_type}:{build_params}"
+
+
+def _base_index(index):
+    # The index inside an IndexIDMap wrapper, or the index itself.
+    return faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+
+
+def apply_search_params(index, settings: Dict[str, Any]):
+    """
+    Sets query-time parameters (IVF nprobe, HNSW efSearch) on an index,
+    looking through an IndexIDMap wrapper.
+    """
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = _section(settings, "ivf")["nprobe"]
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = _section(settings, "hnsw")["ef_search"]
+    return index
+
+
+def supports_id_removal(index) -> bool:
+    """
+    Whether remove_ids keeps an IndexIDMap-wrapped index consistent. Only
+    flat-code indexes (Flat, SQ8, PQ) renumber their remaining vectors the
+    way the wrapper's id map expects; IVF keeps the old internal ids, so its
+    searches return wrong or missing ids afterwards, and HNSW cannot remove
+    at all. Other types have to be rebuilt without the removed vectors.
+    """
+    return isinstance(_base_index(index), faiss.IndexFlatCodes)
+
+
+def reconstruct_vectors(index, ids):
+    """
+    Reads the stored vectors of the given ids back from an IndexIDMap2,
+    enabling the direct map IVF indexes need for this.
+    """
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        base.make_direct_map()
+    return np.vstack([index.reconstruct(int(i)) for i in ids])
+
+
+def build_vector_index(vectors: np.ndarray, settings: Dict[str, Any], with_ids: bool = False):
+    """
+    Creates an index of the configured type, trained on `vectors` if the
+    type needs training. The vectors are not added. With with_ids the index
+    is wrapped in an IndexIDMap2 for add_with_ids/remove_ids/reconstruct.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    index = faiss.index_factory(dim, index_factory_string(settings, n, dim))
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = _section(settings, "hnsw")["ef_construction"]
+    if not index.is_trained:
+        index.train(vectors)
+    apply_search_params(index, settings)
+    return faiss.IndexIDMap2(index) if with_ids else index
+
+
+def bytes_per_vector(index) -> float:
+    if index.ntotal == 0:
+        return 0.0
+    return len(faiss.serialize_index(index)) / index.ntotal
@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# The modules in src/ import each other as top-level modules.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """
+    Runs the test in an empty directory and returns a function that writes
+    its config.json from keyword sections, e.g. config(embeddings={...}).
+    """
+    monkeypatch.chdir(tmp_path)
+
+    def write(**sections):
+        with open("config.json", "w", encoding="utf-8") as f:
+            json.dump(sections, f)
+
+    write()
+    return write
+
+
+@pytest.fixture
+def chain_network():
+    """
+    Returns a function building a network model of n routers R0..Rn-1 in a
+    line, router Ri carrying label 100+i.
+    """
+    def build(n):
+        routers = [f"R{i}" for i in range(n)]
+        return SimpleNamespace(
+            routers=routers,
+            labels=[str(100 + i) for i in range(n)],
+            links=[{"from": a, "to": b} for a, b in zip(routers, routers[1:])],
+            router_labels={router: [str(100 + i)] for i, router in enumerate(routers)},
+        )
+
+    return build
@@ -0,0 +1,141 @@
+import json
+import os
+import signal
+import sys
+
+import pytest
+
+from aalwines_runner import _classify, execute_aalwines, run_aalwines_batch, split_answers
+
+# Stands in for the AalWiNes binary: answers each query line of the -q file
+# with its text, misbehaving on request (BAD, SLEEP, SPIN, NOXCPU, MEMHOG,
+# LIMITS), and logs the number of queries per invocation.
+FAKE_AALWINES = f"""#!{sys.executable}
+import json, resource, signal, sys, time
+args = sys.argv[1:]
+with open(args[args.index("-q") + 1], encoding="utf-8") as f:
+    queries = [line.strip() for line in f if line.strip()]
+with open("calls.log", "a") as f:
+    f.write(f"{{len(queries)}}\\n")
+answers = {{}}
+for number, query in enumerate(queries, start=1):
+    if "BAD" in query:
+        sys.exit("syntax error in query")
+    if "SLEEP" in query:
+        time.sleep(30)
+    if "NOXCPU" in query:
+        signal.signal(signal.SIGXCPU, signal.SIG_IGN)
+    if "SPIN" in query:
+        while True:
+            pass
+    if "MEMHOG" in query:
+        hog = bytearray(2 * 1024 ** 3)
+    if "LIMITS" in query:
+        query = json.dumps([resource.getrlimit(resource.RLIMIT_AS), resource.getrlimit(resource.RLIMIT_CPU)])
+    answers[f"Q{{number}}"] = {{"result": True, "query": query}}
+print(json.dumps({{"answers": answers}}))
+"""
+
+posix_only = pytest.mark.skipif(os.name != "posix", reason="resource limits need POSIX")
+
+
+@pytest.fixture
+def aalwines(config, tmp_path):
+    """
+    Installs the fake binary; returns a function that sets the run limits.
+    """
+    binary = tmp_path / "aalwines"
+    binary.write_text(FAKE_AALWINES, encoding="utf-8")
+    binary.chmod(0o755)
+    for name in ("network.json", "weight.json"):
+        (tmp_path / name).write_text("{}", encoding="utf-8")
+
+    def limits(**run):
+        config(aalwines_bin_path=str(binary), aalwines_cache={"enabled": False},
+               aalwines_run={"timeout_seconds": 20, "cpu_seconds": 10, "memory_mb": 1024, "use_wsl": False, **run})
+
+    limits()
+    return limits
+
+
+def execute(query):
+    return execute_aalwines(query, "network.json", "weight.json", "query.q")
+
+
+def answered(result):
+    return json.loads(result.output)["answers"]["Q1"]["query"]
+
+
+def invocations():
+    with open("calls.log") as f:
+        return [int(line) for line in f]
+
+
+def test_split_answers():
+    output = json.dumps({"network": "n", "answers": {"Q1": {"result": True}, "Q2": {"result": False}}})
+    assert [json.loads(answer) for answer in split_answers(output, 2)] == [
+        {"network": "n", "answers": {"Q1": {"result": True}}},
+        {"network": "n", "answers": {"Q1": {"result": False}}},
+    ]
+    with pytest.raises(ValueError):
+        split_answers(output, 3)
+
+
+@pytest.mark.parametrize("returncode, stderr, status", [
+    (0, "", "ok"),
+    (1, "syntax error", "error"),
+    (-6, "std::bad_alloc", "oom"),
+    (1, "MemoryError", "oom"),
+    pytest.param(-signal.SIGXCPU, "", "timeout", marks=posix_only),
+    pytest.param(-signal.SIGKILL, "", "killed", marks=posix_only),
+])
+def test_classify(returncode, stderr, status):
+    assert _classify(returncode, stderr) == status
+
+
+def test_batch_is_split_per_query(aalwines):
+    results = run_aalwines_batch(["<.*> [.#A] .* [B#.] <.*> 0", "<.*> [.#B] .* [A#.] <.*> 1"],
+                                 "network.json", "weight.json", "query.q")
+    assert [result.status for result in results] == ["ok", "ok"]
+    assert [answered(result) for result in results] == ["<.*> [.#A] .* [B#.] <.*> 0", "<.*> [.#B] .* [A#.] <.*> 1"]
+    assert invocations() == [2]
+
+
+def test_failed_batch_falls_back_to_single_runs(aalwines):
+    results = run_aalwines_batch(["<.*> [.#A] .* [B#.] <.*> 0", "<.*> [.#BAD] .* [A#.] <.*> 0"],
+                                 "network.json", "weight.json", "query.q")
+    assert [result.status for result in results] == ["ok", "error"]
+    assert "syntax error" in results[1].error
+    assert invocations() == [2, 1, 1]
+
+
+def test_wall_clock_timeout(aalwines):
+    aalwines(timeout_seconds=0.5)
+    result = execute("SLEEP")
+    assert result.status == "timeout"
+    assert result.seconds < 5
+
+
+@posix_only
+def test_limits_are_set_before_the_run_starts(aalwines):
+    aalwines(cpu_seconds=7, memory_mb=768)
+    memory = 768 * 1024 * 1024
+    assert json.loads(answered(execute("LIMITS"))) == [[memory, memory], [7, 8]]
+
+
+@posix_only
+def test_cpu_limit_is_a_timeout(aalwines):
+    aalwines(cpu_seconds=1)
+    assert execute("SPIN").status == "timeout"
+
+
+@posix_only
+def test_sigkill_at_the_hard_cpu_limit_is_not_oom(aalwines):
+    aalwines(cpu_seconds=1)
+    assert execute("NOXCPU SPIN").status == "killed"
+
+
+@posix_only
+def test_memory_limit_is_oom(aalwines):
+    aalwines(memory_mb=512)
+    assert execute("MEMHOG").status == "oom"
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+import main
+
+
+def write_lines(path, lines):
+    path.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+
+
+def read_results(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    """
+    Replaces query generation by a stub; returns the descriptions it was
+    called with. A description containing "fail" raises.
+    """
+    calls = []
+
+    def generate(record):
+        calls.append(record["description"])
+        if "fail" in record["description"]:
+            raise RuntimeError("no valid query")
+        return "<.*> [.#A] .* [B#.] <.*> 0", {}, 0.0
+
+    monkeypatch.setattr(main, "_generate_for_record", generate)
+    return calls
+
+
+def run(input_path, output_path, resume=True):
+    return main.run_batch(str(input_path), str(output_path), 2, 1, "weights.json", execute=False, resume=resume)
+
+
+def test_malformed_lines_become_error_records(config, tmp_path, generated):
+    write_lines(tmp_path / "in.jsonl", [
+        '{"id": "a", "description": "from A to B", "network": "n.json"}',
+        '{"id": "b", "description": "from A',
+        '',
+        '[1, 2]',
+        '{"id": "e", "network": "n.json"}',
+        '{"description": "from B to A", "network": "n.json"}',
+    ])
+    counts = run(tmp_path / "in.jsonl", tmp_path / "out.jsonl")
+    assert counts == {"generated": 2, "invalid_record": 3}
+    results = {result["id"]: result for result in read_results(tmp_path / "out.jsonl")}
+    assert results["2"]["error"].startswith("line 2: invalid JSON")
+    assert results["4"]["error"] == "line 4: expected a JSON object"
+    assert results["e"]["error"] == "line 5: missing description"
+    assert results["6"]["status"] == "generated"
+
+
+def test_resume_retries_only_unfinished_records(config, tmp_path, generated):
+    write_lines(tmp_path / "in.jsonl", [
+        json.dumps({"id": record_id, "description": f"from A to B ({record_id})", "network": "n.json"})
+        for record_id in "abcd"
+    ])
+    write_lines(tmp_path / "out.jsonl", [
+        '{"id": "a", "status": "ok"}',
+        '{"id": "b", "status": "run_error"}',
+        '{"id": "c", "status": "aalwines_failed"}',
+        '{"id": "d", "sta',
+    ])
+    assert run(tmp_path / "in.jsonl", tmp_path / "out.jsonl") == {"generated": 2}
+    assert sorted(generated) == ["from A to B (b)", "from A to B (d)"]
+    assert main.completed_record_ids(str(tmp_path / "out.jsonl")) == {"a", "b", "c", "d"}
+
+
+def test_generate_errors_are_retried(config, tmp_path, generated):
+    write_lines(tmp_path / "in.jsonl", ['{"id": "a", "description": "fail", "network": "n.json"}'])
+    assert run(tmp_path / "in.jsonl", tmp_path / "out.jsonl") == {"generate_error": 1}
+    assert run(tmp_path / "in.jsonl", tmp_path / "out.jsonl") == {"generate_error": 1}
+    assert generated == ["fail", "fail"]
+
+
+def test_restart_ignores_previous_results(config, tmp_path, generated):
+    write_lines(tmp_path / "in.jsonl", ['{"id": "a", "description": "from A to B", "network": "n.json"}'])
+    write_lines(tmp_path / "out.jsonl", ['{"id": "a", "status": "ok"}'])
+    assert run(tmp_path / "in.jsonl", tmp_path / "out.jsonl", resume=False) == {"generated": 1}
+    assert [result["id"] for result in read_results(tmp_path / "out.jsonl")] == ["a"]
+
+
+def test_pool_is_shut_down_on_errors(config, tmp_path, monkeypatch):
+    shut_down = []
+
+    class Pool(main.AalwinesPool):
+        def shutdown(self, wait=True, cancel_pending=False):
+            shut_down.append(cancel_pending)
+            super().shutdown(wait, cancel_pending)
+
+    def interrupt(record):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(main, "AalwinesPool", Pool)
+    monkeypatch.setattr(main, "_generate_for_record", interrupt)
+    write_lines(tmp_path / "in.jsonl", ['{"id": "a", "description": "from A to B", "network": "n.json"}'])
+    with pytest.raises(KeyboardInterrupt):
+        run(tmp_path / "in.jsonl", tmp_path / "out.jsonl")
+    assert shut_down == [True]
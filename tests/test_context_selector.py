@@ -0,0 +1,46 @@
+from context_selector import estimate_tokens, match_routers, select_network_context
+
+
+def context_tokens(context):
+    return estimate_tokens(", ".join(context.routers)) + estimate_tokens(", ".join(context.labels))
+
+
+def test_names_neighbours_and_labels(config, chain_network):
+    context = select_network_context("Traffic from R10 to R50 with label 105", chain_network(200))
+    assert context.pruned
+    assert context.routers[:2] == ["R10", "R50"]
+    assert {"R9", "R11", "R49", "R51"} <= set(context.routers)
+    assert context.labels[0] == "105"
+    assert {"110", "150"} <= set(context.labels)
+
+
+def test_configured_budget(config, chain_network):
+    config(prompt_context={"token_budget": 4, "full_list_max_tokens": 0})
+    context = select_network_context("from R10 to R50", chain_network(200))
+    assert context.routers == ["R10", "R50"] and context.labels == []
+
+
+def test_explicit_budget_applies_to_small_networks(config, chain_network):
+    model = chain_network(20)
+    assert not select_network_context("from R1 to R2", model).pruned
+    context = select_network_context("from R1 to R2", model, token_budget=5)
+    assert context.pruned
+    assert context_tokens(context) <= 5
+
+
+def test_quantities_are_not_labels_or_routers(config, chain_network):
+    model = chain_network(800)
+    model.labels.append("2")
+    context = select_network_context("from R10 to R20 with at most 2 link failures within 300 hops", model)
+    assert "2" not in context.labels
+    assert "R300" not in context.routers
+
+
+def test_match_routers_token_boundaries():
+    routers = ["Sydney1", "Sydney2", "Melbourne1", "R777", "R10"]
+    assert match_routers(["sydney"], routers, 0.8) == ["Sydney1", "Sydney2"]
+    assert match_routers(["melborne1"], routers, 0.8) == ["Melbourne1"]
+    assert match_routers(["777"], routers, 0.8) == []
+    assert match_routers(["syd"], routers, 0.8) == []
+    assert match_routers(["r1"], routers, 0.8) == []
+    assert match_routers(["melborne2"], routers, 0.8) == []
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from rag_network import (
+    EXAMPLE_INDEX_DEFAULTS, _new_metadata, compact_index_artifact, ensure_example_index, example_id, get_retriever,
+    update_index_artifact
+)
+from vector_index import INDEX_TYPES
+
+DIM = 32
+
+
+def vectors_of(texts):
+    # A fixed random unit vector per text.
+    rows = [np.random.default_rng(example_id(text) % 2**32).standard_normal(DIM) for text in texts]
+    vectors = np.array(rows, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def top_hit(index, metadata, text):
+    _, ids = index.search(vectors_of([text]), 1)
+    return metadata["entries"].get(int(ids[0][0]))
+
+
+@pytest.fixture(params=INDEX_TYPES)
+def settings(request):
+    return {**EXAMPLE_INDEX_DEFAULTS, "type": request.param, "ivf": {"nlist": 4, "nprobe": 4}, "pq": {"m": 8, "nbits": 4}}
+
+
+@pytest.mark.parametrize("reconstruct", [False, True])
+def test_update_and_compact(settings, reconstruct):
+    chunks = [f"example {i}" for i in range(300)]
+    metadata = _new_metadata("test", settings["type"])
+    index, added, removed = update_index_artifact(None, metadata, chunks, vectors_of, settings)
+    assert (added, removed, index.ntotal) == (300, 0, 300)
+
+    kept = chunks[100:] + ["example new"]
+    index, added, removed = update_index_artifact(index, metadata, kept, vectors_of, settings)
+    assert (added, removed) == (1, 100)
+    assert len(metadata["tombstones"]) == 100
+
+    index = compact_index_artifact(index, metadata, None if reconstruct else vectors_of, settings)
+    assert index.ntotal == len(kept) == len(metadata["entries"])
+    assert not metadata["tombstones"]
+    for text in ("example 100", "example 250", "example new"):
+        assert top_hit(index, metadata, text) == text
+
+
+def test_compact_everything_removed(settings):
+    metadata = _new_metadata("test", settings["type"])
+    index, _, _ = update_index_artifact(None, metadata, [f"example {i}" for i in range(50)], vectors_of, settings)
+    update_index_artifact(index, metadata, [], vectors_of, settings)
+    index = compact_index_artifact(index, metadata, vectors_of, settings)
+    assert index.ntotal == 0 and not metadata["entries"]
+
+
+def test_revived_example_is_not_tombstoned(settings):
+    chunks = [f"example {i}" for i in range(50)]
+    metadata = _new_metadata("test", settings["type"])
+    index, _, _ = update_index_artifact(None, metadata, chunks, vectors_of, settings)
+    update_index_artifact(index, metadata, chunks[1:], vectors_of, settings)
+    index, added, removed = update_index_artifact(index, metadata, chunks, vectors_of, settings)
+    assert (added, removed, metadata["tombstones"]) == (0, 0, set())
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_search_after_automatic_compaction(config, tmp_path, index_type):
+    config(
+        embeddings={"provider": "local", "local": {"dim": 64}},
+        example_index={"type": index_type, "ivf": {"nlist": 4, "nprobe": 4}, "pq": {"m": 8, "nbits": 4},
+                       "compact_tombstone_ratio": 0.2}
+    )
+    chunks = [f"Find a path from router R{i} to router S{i * 7} avoiding T{i}" for i in range(200)]
+    cache_file, index_dir = str(tmp_path / "examples.json"), str(tmp_path / "index")
+    ensure_example_index(chunks, cache_file=cache_file, index_dir=index_dir)
+    # Dropping half the corpus tombstones more than the ratio and compacts.
+    paths = ensure_example_index(chunks[100:], cache_file=cache_file, index_dir=index_dir)
+    retriever = get_retriever(*paths)
+    assert retriever.search(chunks[150], 1) == [chunks[150]]
+
+
+def test_empty_corpus(config, tmp_path):
+    config(embeddings={"provider": "local"})
+    with pytest.raises(ValueError):
+        ensure_example_index([], cache_file=str(tmp_path / "examples.json"), index_dir=str(tmp_path / "index"))
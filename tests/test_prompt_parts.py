@@ -0,0 +1,17 @@
+from prompt_builder import build_network_segment, build_network_selection
+
+
+def test_small_network_lists_everything_in_the_segment(config, chain_network):
+    model = chain_network(5)
+    assert build_network_segment(model) == "Network routers: R0, R1, R2, R3, R4\nNetwork labels: 100, 101, 102, 103, 104\n"
+    assert build_network_selection("from R1 to R3", model) == ""
+
+
+def test_pruned_lists_follow_the_stable_segment(config, chain_network):
+    model = chain_network(500)
+    segment = build_network_segment(model)
+    assert "R10" not in segment and "500 routers" in segment
+    assert build_network_segment(model) == segment
+    selection = build_network_selection("from R10 to R20", model)
+    assert "Network routers: R10, R20" in selection
+    assert "R300" not in selection
@@ -0,0 +1,48 @@
+import pytest
+
+from query_parser import QuerySyntaxError, find_query, parse_query
+
+
+def test_parses_parts():
+    query = parse_query("<10 20> [.#R0] ([R0#R1] | [^R0#R2])+ [R3#.] <.*> 2 dual")
+    assert (query.start_label, query.end_label, query.k, query.mode) == ("<10 20>", "<.*>", 2, "DUAL")
+    assert query.path_text == "[.#R0] ([R0#R1] | [^R0#R2])+ [R3#.]"
+    assert [atom.links for atom in query.atoms()] == [[(".", "R0")], [("R0", "R1")], [("R0", "R2")], [("R3", ".")]]
+    assert [atom.negated for atom in query.atoms()] == [False, False, True, False]
+    assert [label.name for label in query.labels()] == ["10", "20"]
+    assert [query.text[slice(*label.span)] for label in query.labels()] == ["10", "20"]
+
+
+def test_format_normalizes_spacing_and_mode():
+    query = parse_query("<.*>   [.#R0]  .*  [R3#.] <.*>   1")
+    assert query.format() == "<.*> [.#R0]  .*  [R3#.] <.*> 1"
+    assert query.format("DUAL") == "<.*> [.#R0]  .*  [R3#.] <.*> 1 DUAL"
+
+
+def test_find_query_skips_answer_decoration():
+    assert find_query("Query: `<.*> [.#R0] [R0#.] <.*> 0`").format() == "<.*> [.#R0] [R0#.] <.*> 0"
+
+
+@pytest.mark.parametrize("text, kind, span", [
+    ("<.*> [.#R0 .* [R3#.] <.*> 0", "unclosed_bracket", (5, 14)),
+    ("<.*> [.#R0]] .* [R3#.] <.*> 0", "unopened_bracket", (11, 12)),
+    ("<.*> [.#R0] (.* [R3#.] <.*> 0", "unclosed_paren", (12, 13)),
+    ("<.*> [.#R0] .*) [R3#.] <.*> 0", "unopened_paren", (14, 15)),
+    ("<.*> [.#R0] .* [R3#.] <.* 0", "unclosed_label", (22, 27)),
+    ("<.*> [.#R0] .* [R3#.] <.*>", "missing_k", (26, 27)),
+    ("<.*> [.#R0] .* [R3#.] <.*> 1 FOO", "syntax", (29, 32)),
+    ("<.*> [.#R0] .* [R3#.] <.*> 1 DUAL extra", "syntax", (34, 39)),
+    ("<.*>  <.*> 0", "syntax", (4, 6)),
+])
+def test_error_spans(text, kind, span):
+    with pytest.raises(QuerySyntaxError) as error:
+        parse_query(text)
+    assert (error.value.kind, error.value.span) == (kind, span)
+    assert error.value.text == text
+
+
+def test_error_pointer():
+    with pytest.raises(QuerySyntaxError) as error:
+        parse_query("<.*> [.#R0] .* [R3#.] <.*> 1 FOO")
+    assert error.value.pointer().splitlines()[1] == " " * 29 + "^^^"
+    assert "at 'FOO'" in str(error.value)
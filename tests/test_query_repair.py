@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from network_parser import load_network_model
+from query_repair import failures_from_description, repair_query
+
+NETWORKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "networks")
+
+
+@pytest.fixture(scope="module")
+def aarnet():
+    return load_network_model(os.path.join(NETWORKS, "Aarnet_Gen_1.json"))
+
+
+@pytest.mark.parametrize("query, description, repaired", [
+    ("⟨.*⟩ [.#Adelaide1] .* [Armidale#.] ⟨.*⟩ 0", "", "<.*> [.#Adelaide1] .* [Armidale#.] <.*> 0"),
+    ("<.*> [.#Adelaide1 .* [Armidale#.] <.*> 0", "", "<.*> [.#Adelaide1] .* [Armidale#.] <.*> 0"),
+    ("<.*> [.#Adelaide1] (.* [Armidale#.] <.*> 0", "", "<.*> [.#Adelaide1] (.* [Armidale#.]) <.*> 0"),
+    ("<.*> [.#Adelaide1] .* [Armidale#.] <.* 1", "", "<.*> [.#Adelaide1] .* [Armidale#.] <.*> 1"),
+    ("<.*> [.#Adelaide1] .* [Armidale#.] <.*>", "with at most one link failure", "<.*> [.#Adelaide1] .* [Armidale#.] <.*> 1"),
+    ("<.*> [.#Melborne1] .* [Armidale#.] <.*> 0", "", "<.*> [.#Melbourne1] .* [Armidale#.] <.*> 0"),
+])
+def test_repairs(aarnet, query, description, repaired):
+    text, repairs = repair_query(query, aarnet, description)
+    assert text == repaired
+    assert repairs
+
+
+def test_label_formatting_is_repaired(aarnet):
+    text, repairs = repair_query("<050510> [.#Adelaide1] .* [Armidale#.] <.*> 0", aarnet)
+    assert text == "<50510> [.#Adelaide1] .* [Armidale#.] <.*> 0"
+    assert repairs == ["label 050510 -> 50510"]
+
+
+@pytest.mark.parametrize("label", ["505100", "5051", "50610"])
+def test_unknown_numeric_labels_are_kept(aarnet, label):
+    query = f"<{label}> [.#Adelaide1] .* [Armidale#.] <.*> 0"
+    assert repair_query(query, aarnet) == (query, [])
+
+
+def test_unparseable_query(aarnet):
+    assert repair_query("hello world", aarnet) == (None, [])
+
+
+@pytest.mark.parametrize("description, k", [
+    ("from A to B", 0),
+    ("with at most one link failure", 1),
+    ("allowing 3 failures", 3),
+    ("with no link failures", 0),
+])
+def test_failures_from_description(description, k):
+    assert failures_from_description(description) == k